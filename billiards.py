@@ -1,43 +1,104 @@
-<<<<<<< HEAD
-=======
 #Name: Michelle Lin, ENGR 1050, Homework 8, Spring 2023
 #Collaborators: None
 #Program Description: Simulation of billiards
 
->>>>>>> 7c07a026e30db8fc18b855581728a673a92d9ac4
 #import modules
+import time
+import heapq
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+#matplotlib is imported by the functions that draw, so headless runs never load it
+
+# Outline of a ball of radius 1 at the origin, computed once and scaled/translated per ball
+THETA = np.arange(0,2*np.pi,0.01)
+UNIT_CIRCLE = np.column_stack([np.cos(THETA), np.sin(THETA)])
+
+class _TableField(object):
+    """ Ball attribute that lives in a row of the owning table's array once the
+    ball is stored on a table, and on the ball itself before that
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, ball, owner=None):
+        if ball is None:
+            return self
+        if ball.table is None:
+            return ball.__dict__[self.name]
+        #row view into the table array, so in-place edits reach the table
+        return getattr(ball.table, self.name)[ball.index]
+
+    def __set__(self, ball, value):
+        if ball.table is None:
+            ball.__dict__[self.name] = value
+        else:
+            getattr(ball.table, self.name)[ball.index] = value
 
 class Ball(object):
-    def __init__(self,color='r'):
+    # Ball state, stored by the table once the ball is added to one
+    pos = _TableField('pos')
+    vel = _TableField('vel')
+    radius = _TableField('radius')
+    color = _TableField('color')
+
+    def __init__(self,color='r',pos=None,vel=None,radius=0.5):
+        # Table that owns this ball's state and the ball's row in it
+        self.table = None
+        self.index = None
+
         # Stores plot information so we can animate
         self.plot_handle = []
         #sets color to be input
         self.color = color
         
         # Ball parameters
-        self.radius = 0.5
+        self.radius = radius
 
-        plt.title('Click on the ball location')
-        pts = plt.ginput(1)
-        self.pos = np.array(pts[0])
-        self.draw()
+        #asks for clicks only for what was not given
+        if pos is None or vel is None:
+            import matplotlib.pyplot as plt
+        if pos is None:
+            plt.title('Click on the ball location')
+            pts = plt.ginput(1)
+            self.pos = np.array(pts[0])
+            self.draw()
+        else:
+            self.pos = np.array(pos, dtype=float)
 
-        plt.title('Click to indicate the ball velocity')
-        pts = plt.ginput(1)
-        self.vel = (np.array(pts[0]) - self.pos)
-        self.vel = self.vel / np.linalg.norm(self.vel)
+        if vel is None:
+            plt.title('Click to indicate the ball velocity')
+            pts = plt.ginput(1)
+            self.vel = (np.array(pts[0]) - self.pos)
+            self.vel = self.vel / np.linalg.norm(self.vel)
+        else:
+            self.vel = np.array(vel, dtype=float)
+
+        if pos is None or vel is None:
+            plt.title('')
 
-        plt.title('')
+    @classmethod
+    def view(cls, table, index):
+        """
+        Creates a ball for row index of the table arrays without asking for clicks
+        Input: table [Billiards], index [int]
+        Output: ball
+        Usage: Ball.view(billiard_sim, 0)
+        Returns: ball whose pos/vel are row 0 of billiard_sim.pos/vel
+        """
+        ball = cls.__new__(cls)
+        ball.table = table
+        ball.index = index
+        ball.plot_handle = []
+        return ball
     
     def calc_circ(self):
-        theta = np.arange(0,2*np.pi,0.01)
-        xc = self.radius * np.cos(theta)+self.pos[0]
-        yc = self.radius * np.sin(theta)+self.pos[1]
+        xc = self.radius * UNIT_CIRCLE[:,0]+self.pos[0]
+        yc = self.radius * UNIT_CIRCLE[:,1]+self.pos[1]
         return xc, yc
 
     def draw(self):
+        import matplotlib.pyplot as plt
         xc, yc = self.calc_circ()
         self.plot_handle = plt.plot(xc,yc,'-'+self.color)
 
@@ -84,9 +145,12 @@ class Ball(object):
         self_v_init = np.dot(self.vel, collision_dir)
         other_v_init = np.dot(other_ball.vel, collision_dir)
 
-        # Calculate new velocities in collision direction using the given formulas
-        self_v_final= self_v_init - (((self_v_init-other_v_init)*(self.pos-other_ball.pos))/((abs(self.pos-other_ball.pos))**2))*(self.pos-other_ball.pos)
-        other_v_final = other_v_init - (((other_v_init-self_v_init)*(other_ball.pos-self.pos))/((abs(other_ball.pos-self.pos))**2))*(other_ball.pos-self.pos)
+        # Calculate new velocities in collision direction. The balls have equal
+        # mass, so they exchange their velocities along the collision direction
+        # (the per-component form of the formula divides by zero when the balls
+        # line up along an axis)
+        self_v_final = other_v_init
+        other_v_final = self_v_init
 
         # Calculate the final velocities in the other orthogonal direction
         self_v_final_ortho = self.vel - self_v_init * collision_dir
@@ -99,14 +163,76 @@ class Ball(object):
 class BlueBall(Ball):
     """ This subclass inherits from the ball class and creates a blue ball object
     """
-    def __init__(self):
-        super().__init__(color='b')
+    def __init__(self,pos=None,vel=None):
+        super().__init__(color='b',pos=pos,vel=vel)
         
 class RedBall(Ball):
     """ This subclass inherits from the ball class and creates a red ball object
     """
-    def __init__(self):
-        super().__init__(color='r')
+    def __init__(self,pos=None,vel=None):
+        super().__init__(color='r',pos=pos,vel=vel)
+
+def _overlapping_pairs(pos, radius, width, height, table=None):
+    #spatial hash broad phase and narrow phase shared by Billiards and BilliardsEnsemble.
+    #pos [M x 2], radius [M], table [M int or None], balls of different tables never pair.
+    #returns i, j [1D int np arrays], i < j, sorted by i then j
+    n = len(radius)
+    if n < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    #cells are one ball diameter wide, so touching balls are in neighbouring cells
+    cell = 2*radius.max()
+    nx = max(1, int(np.ceil(width/cell)))
+    ny = max(1, int(np.ceil(height/cell)))
+    cx = np.clip((pos[:,0]//cell).astype(int), 0, nx-1)
+    cy = np.clip((pos[:,1]//cell).astype(int), 0, ny-1)
+    #each table has its own block of cell keys
+    offset = 0 if table is None else table*(nx*ny)
+
+    #sorts balls by cell so the balls of each cell are contiguous
+    key = offset + cy*nx + cx
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+
+    #half of the 3x3 neighbourhood, so each pair of cells is visited once
+    ii = []
+    jj = []
+    for dx, dy in ((0,0), (1,0), (-1,1), (0,1), (1,1)):
+        ncx = cx + dx
+        ncy = cy + dy
+        valid = (ncx >= 0) & (ncx < nx) & (ncy < ny)
+        i_ball = np.nonzero(valid)[0]
+        nb_key = (offset if table is None else offset[valid]) + ncy[valid]*nx + ncx[valid]
+
+        #range of sorted balls that sit in the neighbouring cell
+        lo = np.searchsorted(sorted_key, nb_key, 'left')
+        hi = np.searchsorted(sorted_key, nb_key, 'right')
+        count = hi - lo
+        total = count.sum()
+        within = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+        i_pair = np.repeat(i_ball, count)
+        j_pair = order[np.repeat(lo, count) + within]
+
+        #within one cell keep each pair once
+        if dx == 0 and dy == 0:
+            keep = j_pair > i_pair
+            i_pair = i_pair[keep]
+            j_pair = j_pair[keep]
+        ii.append(i_pair)
+        jj.append(j_pair)
+    ii = np.concatenate(ii)
+    jj = np.concatenate(jj)
+
+    #narrow phase, same test as check_collide
+    d = pos[ii] - pos[jj]
+    dist = np.sqrt((d*d).sum(axis=1))
+    hit = dist < radius[ii] + radius[jj]
+    i = np.minimum(ii[hit], jj[hit])
+    j = np.maximum(ii[hit], jj[hit])
+
+    #same order as the all-pairs loop
+    order = np.lexsort((j, i))
+    return i[order], j[order]
 
 class Billiards(object):
     def __init__(self, h, w):
@@ -118,55 +244,134 @@ class Billiards(object):
         # Plotting information
         self.fig = []
 
+        # Functions called with the table after every update, e.g. the renderer
+        self.observers = []
+
         # Balls on the table
         self.ball = []
 
-    def add_ball(self):
+        # Use the spatial hash broad phase in handle_collide_balls
+        self.broad_phase = True
+
+        # Ball state, one row per ball. Balls on the table are views into these
+        self.pos = np.zeros((0,2))
+        self.vel = np.zeros((0,2))
+        self.radius = np.zeros(0)
+        self.color = np.zeros(0, dtype=object)
+
+    @classmethod
+    def from_arrays(cls, h, w, pos, vel, radius=0.5, color='r'):
+        """
+        Builds a table with balls at the given positions and velocities, no figure needed
+        Input: h, w [float], pos [Nx2 np array], vel [Nx2 np array],
+               radius [float or 1D np array], color [str or sequence of str]
+        Output: Billiards
+        Usage: Billiards.from_arrays(10, 10, [[2,5],[6,5]], [[1,0],[-1,0]])
+        Returns: table with two balls
+        """
+        table = cls(h, w)
+        table.store_arrays(pos, vel, radius, color)
+        return table
+
+    def add_ball(self, num_red=None, num_blue=None):
         """
         Asks user for input on number of balls of each color and adds to ball list
-        Input: self
+        Input: self, num_red [int], num_blue [int], asked for when not given
         Output: None
         Usage: add_ball()
         Returns: None
         """
         #asks user how many red and blue balls and sets to integers
-        num_red=(int(input("How many red balls? (Integer value)")))
-        num_blue=(int(input("How many blue balls? (Integer values)")))
+        if num_red is None:
+            num_red=(int(input("How many red balls? (Integer value)")))
+        if num_blue is None:
+            num_blue=(int(input("How many blue balls? (Integer values)")))
 
         #for loop based on number of red balls
         for i in range(num_red):
             ball=RedBall()
             #add red balls to list of balls
-            self.ball.append(ball)
+            self.store_ball(ball)
         
         #for loop based on number of blue balls
         for i in range(num_blue):
             ball=BlueBall()
             #adds blue balls to list of balls
-            self.ball.append(ball)
+            self.store_ball(ball)
+
+    def store_ball(self, ball):
+        """
+        Moves the state of a ball into the table arrays and adds it to the ball list
+        Input: self, ball
+        Output: None
+        Usage: store_ball(RedBall())
+        Returns: None
+        """
+        #appends a row for the ball to each state array
+        self.pos = np.vstack([self.pos, ball.pos])
+        self.vel = np.vstack([self.vel, ball.vel])
+        self.radius = np.append(self.radius, ball.radius)
+        self.color = np.append(self.color, np.array([ball.color], dtype=object))
+
+        #from now on the ball reads and writes its row of the table arrays
+        ball.index = len(self.ball)
+        ball.table = self
+        self.ball.append(ball)
+
+    def store_arrays(self, pos, vel, radius=0.5, color='r'):
+        """
+        Adds balls straight from arrays of positions and velocities
+        Input: self, pos [Nx2 np array], vel [Nx2 np array],
+               radius [float or 1D np array], color [str or sequence of str]
+        Output: None
+        Usage: store_arrays(np.array([[1,1],[5,5]]), np.array([[1,0],[0,1]]))
+        Returns: None
+        """
+        pos = np.asarray(pos, dtype=float).reshape(-1,2)
+        vel = np.asarray(vel, dtype=float).reshape(-1,2)
+        n = len(pos)
+        colors = np.empty(n, dtype=object)
+        colors[:] = color
+
+        #appends all rows at once
+        start = len(self.ball)
+        self.pos = np.vstack([self.pos, pos])
+        self.vel = np.vstack([self.vel, vel])
+        self.radius = np.append(self.radius, np.broadcast_to(radius, (n,)))
+        self.color = np.append(self.color, colors)
+
+        #creates a view ball for each new row
+        for i in range(start, start+n):
+            self.ball.append(Ball.view(self, i))
     
-    def setup_animation(self):
+    def setup_animation(self, fps=30):
+        import matplotlib.pyplot as plt
+
         # We haven't see this line before. It basically sets the interactive property
         # of the plot so that we can update the plot repeatedly in the code
         plt.ion()
 
-        self.fig = plt.figure()
-        plt.plot([0,0,self.width,self.width,0], [0,self.height,self.height,0,0], '-k')
-        plt.axis('equal')
-        plt.show()
-
-    def redraw(self):
-        #updates balls that are in the self.ball list
-        for ball in self.ball:
-            ball.redraw()
+        #draws the table and redraws the balls at most fps times per second
+        self.renderer = BilliardsRenderer(self, fps)
+        self.fig = self.renderer.fig
+        self.add_observer(self.renderer)
 
-        plt.title("Current time: "+str(self.current_time))
+    def add_observer(self, observer):
+        """
+        Registers a function that is called with the table after every update
+        Input: self, observer [function of the table]
+        Output: None
+        Usage: add_observer(lambda table: print(table.current_time))
+        Returns: None
+        """
+        self.observers.append(observer)
 
-        # These next two lines force the plot to update
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+    def redraw(self):
+        #draws the current state right away, regardless of the frame rate
+        self.renderer.draw()
 
     def is_closed(self):
+        import matplotlib.pyplot as plt
         return not plt.fignum_exists(self.fig.number)
 
     def update(self, dt):
@@ -177,16 +382,12 @@ class Billiards(object):
         Usage: update(.01)
         Returns: Updated ball animation
         """
-        # Continuous update
-        #checks ball object is in ball list and updates 
-        for ball in self.ball:
-            ball.update(dt)
+        # Continuous update of all balls at once
+        self.pos += self.vel*dt
 
-            #discrete transitions
-            #checks for collision with wall and reflects velocity
-            did_collide, reflect_dir = self.check_collide_wall(ball)
-            if did_collide:
-                ball.v_reflect(reflect_dir)
+        #discrete transitions
+        #checks for collision with wall and reflects velocity
+        self.handle_collide_walls()
 
         # checks for ball collisions with each other
         self.handle_collide_balls()
@@ -194,8 +395,83 @@ class Billiards(object):
         # Update time
         self.current_time = self.current_time + dt
 
-        # Animate all balls
-        self.redraw()
+        # Notify observers, such as the animation
+        for observer in self.observers:
+            observer(self)
+
+    def simulate(self, n_steps, dt, record_every=1):
+        """
+        Runs n_steps updates and returns the trajectory
+        Input: self, n_steps [int], dt [float], record_every [int], keeps every k-th step
+        Output: t [1D np array], pos [n_out x N x 2 np array], vel [n_out x N x 2 np array]
+        Usage: simulate(100, 0.1)
+        Returns: times, positions and velocities, starting with the current state
+        """
+        n_out = n_steps//record_every + 1
+        n = len(self.ball)
+        t = np.zeros(n_out)
+        pos = np.zeros((n_out, n, 2))
+        vel = np.zeros((n_out, n, 2))
+
+        #records the starting state
+        t[0] = self.current_time
+        pos[0] = self.pos
+        vel[0] = self.vel
+
+        k = 1
+        for step in range(1, n_steps+1):
+            self.update(dt)
+            if step % record_every == 0:
+                t[k] = self.current_time
+                pos[k] = self.pos
+                vel[k] = self.vel
+                k += 1
+        return t, pos, vel
+
+    def record(self, path, n_steps, dt, every=1, dtype=np.float32):
+        """
+        Runs n_steps updates and streams the trajectory to a .npy file instead of memory
+        Input: self, path [str], n_steps [int], dt [float],
+               every [int], keeps every k-th step, dtype of the stored positions/velocities
+        Output: None
+        Usage: record('run.npy', 10000, 0.01, every=10)
+        Returns: None, the frames can be read back with load_trajectory('run.npy')
+        """
+        recorder = TrajectoryRecorder(path, len(self.ball), n_steps//every + 1, every, dtype)
+        recorder.record(self)
+        self.add_observer(recorder)
+        try:
+            for step in range(n_steps):
+                self.update(dt)
+        finally:
+            self.observers.remove(recorder)
+            recorder.close()
+
+    def checkpoint(self, path):
+        """
+        Saves the full table state so a run can be resumed with Billiards.restore
+        Input: self, path [str], .npz file
+        Output: None
+        Usage: checkpoint('table.npz')
+        Returns: None
+        """
+        np.savez(path, height=self.height, width=self.width, current_time=self.current_time,
+                 pos=self.pos, vel=self.vel, radius=self.radius, color=self.color.astype(str))
+
+    @classmethod
+    def restore(cls, path):
+        """
+        Builds a table from a checkpoint written by checkpoint
+        Input: path [str], .npz file
+        Output: Billiards
+        Usage: Billiards.restore('table.npz')
+        Returns: table in the saved state
+        """
+        with np.load(path) as state:
+            table = cls.from_arrays(state['height'].item(), state['width'].item(), state['pos'],
+                                    state['vel'], state['radius'], state['color'].tolist())
+            table.current_time = state['current_time'].item()
+        return table
 
     def check_collide_wall(self, the_ball):
         if the_ball.pos[0] > self.width-the_ball.radius:
@@ -208,7 +484,44 @@ class Billiards(object):
             return True, 1
         
         return False, None
+
+    def check_collide_walls(self):
+        """
+        Checks all balls for collisions with the walls at once
+        Input: self
+        Output: hit_x, hit_y [1D bool np arrays]
+        Usage: check_collide_walls()
+        Returns: (array([False, True]), array([False, False]))
+        """
+        x = self.pos[:,0]
+        y = self.pos[:,1]
+        hit_x = (x > self.width-self.radius) | (x < self.radius)
+        #like check_collide_wall, a ball that hits a side wall only reflects in x
+        hit_y = ((y > self.height-self.radius) | (y < self.radius)) & ~hit_x
+        return hit_x, hit_y
+
+    def handle_collide_walls(self):
+        """
+        Reflects the velocity of every ball that hits a wall
+        Input: self
+        Output: None
+        Usage: handle_collide_walls()
+        Returns: None
+        """
+        hit_x, hit_y = self.check_collide_walls()
+        self.vel[hit_x,0] = -self.vel[hit_x,0]
+        self.vel[hit_y,1] = -self.vel[hit_y,1]
     
+    def find_collision_pairs(self):
+        """
+        Finds all pairs of overlapping balls using a spatial hash broad phase
+        Input: self
+        Output: i, j [1D int np arrays], i < j, sorted by i then j
+        Usage: find_collision_pairs()
+        Returns: (array([0, 3]), array([2, 4]))
+        """
+        return _overlapping_pairs(self.pos, self.radius, self.width, self.height)
+
     def handle_collide_balls(self):
         """
         Checks if two balls collide and changes velocities
@@ -217,6 +530,23 @@ class Billiards(object):
         Usage: handle_collide_balls
         Returns: None
         """
+        if not self.broad_phase:
+            self.handle_collide_balls_all_pairs()
+            return
+
+        #only pairs found by the broad phase can collide
+        i, j = self.find_collision_pairs()
+        for k in range(len(i)):
+            self.ball[i[k]].v_ball_collision(self.ball[j[k]])
+
+    def handle_collide_balls_all_pairs(self):
+        """
+        Checks every pair of balls for a collision and changes velocities
+        Input: self
+        Output: None
+        Usage: handle_collide_balls_all_pairs()
+        Returns: None
+        """
         # Check all pairs of balls for collisions
         for i in range(len(self.ball)):
             for j in range(i+1, len(self.ball)):
@@ -227,18 +557,640 @@ class Billiards(object):
                 if ball1.check_collide(ball2):
                     ball1.v_ball_collision(ball2)
 
-# Initialize
-billiard_sim = Billiards(10,10)
-billiard_sim.setup_animation()
-billiard_sim.add_ball()
-
-# Simulate
-dt = 0.1
-Tf = 10
-while (billiard_sim.current_time < Tf) and (not billiard_sim.is_closed()):
-    billiard_sim.update(dt)
-    plt.pause(dt)
-
-plt.title('Simulation complete. Close the figure to exit')
-while not billiard_sim.is_closed():
-    plt.pause(1)
\ No newline at end of file
+class BilliardsRenderer(object):
+    """ Animates a Billiards table. All balls are drawn by one LineCollection
+    built from an outline computed once, and frames are blitted over a saved
+    background. Used as a table observer, it draws at most fps frames per
+    second of wall-clock time, however small the physics dt is.
+    """
+    def __init__(self, table, fps=30, n_outline=64):
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        self.table = table
+        self.fps = fps
+
+        # Closed outline of a unit ball, coarser than calc_circ since it is drawn for every ball
+        theta = np.linspace(0, 2*np.pi, n_outline+1)
+        self.outline = np.column_stack([np.cos(theta), np.sin(theta)])
+
+        # Wall-clock time of the last frame
+        self.last_frame = -np.inf
+
+        #draws the table, this is the background that frames are blitted over
+        self.fig = plt.figure()
+        self.ax = self.fig.gca()
+        self.ax.plot([0,0,table.width,table.width,0], [0,table.height,table.height,0,0], '-k')
+        self.ax.axis('equal')
+
+        #animated artists are left out of full redraws and blitted instead
+        self.balls = LineCollection([], animated=True)
+        self.ax.add_collection(self.balls)
+        self.time_text = self.ax.text(0.02, 0.98, '', transform=self.ax.transAxes, va='top', animated=True)
+
+        # Number of balls in the collection, 0 until the first frame
+        self.n_balls = 0
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        plt.show()
+
+    def on_draw(self, event):
+        #a full redraw (first show, resize) replaces the background
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def reset(self):
+        """
+        Sets the collection up for the balls currently on the table
+        Input: self
+        Output: None
+        Usage: reset()
+        Returns: None
+        """
+        #removes the outlines drawn while clicking balls in, the collection draws them now
+        for ball in self.table.ball:
+            for handle in ball.plot_handle:
+                handle.remove()
+            ball.plot_handle = []
+        self.balls.set_colors(list(self.table.color))
+        self.n_balls = len(self.table.ball)
+        self.fig.canvas.draw()
+
+    def draw_artists(self):
+        table = self.table
+        #translates the scaled unit circle to every ball at once
+        outlines = table.radius[:,None,None]*self.outline[None,:,:] + table.pos[:,None,:]
+        self.balls.set_segments(outlines)
+        self.time_text.set_text("Current time: "+str(table.current_time))
+        self.ax.draw_artist(self.balls)
+        self.ax.draw_artist(self.time_text)
+
+    def draw(self):
+        """
+        Draws the balls at their current positions
+        Input: self
+        Output: None
+        Usage: draw()
+        Returns: None
+        """
+        if self.n_balls != len(self.table.ball):
+            self.reset()
+        canvas = self.fig.canvas
+        #the background is only captured by a full draw, which has not happened yet on an empty table
+        if self.background is None:
+            canvas.draw()
+        canvas.restore_region(self.background)
+        self.draw_artists()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        self.last_frame = time.perf_counter()
+
+    def __call__(self, table):
+        #skips the frame if the last one was less than 1/fps seconds ago
+        if time.perf_counter() - self.last_frame >= 1/self.fps:
+            self.draw()
+
+class TrajectoryRecorder(object):
+    """ Table observer that streams positions and velocities into a preallocated
+    .npy file of frames. Frames are collected in a small buffer and written a
+    chunk at a time, so the trajectory never has to fit in memory.
+    """
+    def __init__(self, path, n_balls, n_frames, every=1, dtype=np.float32, chunk=256):
+        self.path = path
+        self.every = every
+
+        # One frame per record: time, positions and velocities
+        self.dtype = np.dtype([('t', np.float64), ('pos', dtype, (n_balls,2)), ('vel', dtype, (n_balls,2))])
+        self.frames = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(n_frames,))
+
+        # Frames not yet written to the file
+        self.buffer = np.zeros(chunk, dtype=self.dtype)
+        self.n_buffered = 0
+
+        # Frames written to the file and updates seen as an observer
+        self.n_written = 0
+        self.n_updates = 0
+
+    def record(self, table):
+        """
+        Adds the current state of the table as the next frame
+        Input: self, table [Billiards]
+        Output: None
+        Usage: record(billiard_sim)
+        Returns: None
+        """
+        if self.n_written + self.n_buffered == len(self.frames):
+            raise ValueError("all "+str(len(self.frames))+" frames of "+str(self.path)+" are used")
+        frame = self.buffer[self.n_buffered]
+        frame['t'] = table.current_time
+        frame['pos'] = table.pos
+        frame['vel'] = table.vel
+        self.n_buffered += 1
+        if self.n_buffered == len(self.buffer):
+            self.flush()
+
+    def __call__(self, table):
+        #keeps every k-th update
+        self.n_updates += 1
+        if self.n_updates % self.every == 0:
+            self.record(table)
+
+    def flush(self):
+        """
+        Writes the buffered frames to the file
+        Input: self
+        Output: None
+        Usage: flush()
+        Returns: None
+        """
+        self.frames[self.n_written:self.n_written+self.n_buffered] = self.buffer[:self.n_buffered]
+        self.n_written += self.n_buffered
+        self.n_buffered = 0
+
+    def close(self):
+        """
+        Writes the remaining frames and cuts the file down to the frames recorded
+        Input: self
+        Output: None
+        Usage: close()
+        Returns: None
+        """
+        self.flush()
+        self.frames.flush()
+        n_frames = len(self.frames)
+        del self.frames
+        if self.n_written < n_frames:
+            truncate_npy(self.path, self.n_written)
+
+def truncate_npy(path, n_rows):
+    """
+    Shortens a 1D .npy file in place to its first n_rows entries
+    Inputs: path [str], n_rows [int]
+    Output: None
+    Usage: truncate_npy('run.npy', 120)
+        Returns: None
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+            write_header = np.lib.format.write_array_header_1_0
+        else:
+            read_header = np.lib.format.read_array_header_2_0
+            write_header = np.lib.format.write_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+
+        #numpy leaves room in the header for the length to change in place
+        f.seek(0)
+        write_header(f, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (n_rows,)})
+        if f.tell() != offset:
+            raise ValueError("cannot shorten the header of "+str(path)+" in place")
+        f.truncate(offset + n_rows*dtype.itemsize)
+
+def load_trajectory(path):
+    """
+    Opens a recorded trajectory without reading it into memory
+    Input: path [str], .npy file written by Billiards.record or TrajectoryRecorder
+    Output: frames [memory-mapped structured np array with fields t, pos, vel]
+    Usage: frames = load_trajectory('run.npy'); frames['pos'][10]
+        Returns: positions of all balls in frame 10
+    """
+    return np.load(path, mmap_mode='r')
+
+def replay_trajectory(path, h, w, radius=0.5, color='r', fps=30, every=1):
+    """
+    Animates a recorded trajectory without re-simulating it
+    Inputs: path [str], .npy file of frames
+            h, w [float], table size
+            radius [float or 1D np array], color [str or sequence of str]
+            fps [int], frames shown per second
+            every [int], shows every k-th frame
+    Output: None
+    Usage: replay_trajectory('run.npy', 10, 10)
+        Returns: None
+    """
+    import matplotlib.pyplot as plt
+
+    frames = load_trajectory(path)
+    table = Billiards.from_arrays(h, w, frames['pos'][0], frames['vel'][0], radius, color)
+    plt.ion()
+    renderer = BilliardsRenderer(table, fps)
+    for k in range(0, len(frames), every):
+        if not plt.fignum_exists(renderer.fig.number):
+            break
+        #only the frames shown are read from the file
+        table.pos[:] = frames['pos'][k]
+        table.vel[:] = frames['vel'][k]
+        table.current_time = frames['t'][k]
+        renderer.draw()
+        renderer.fig.canvas.start_event_loop(1/fps)
+
+class EventDrivenBilliards(object):
+    """ Advances a Billiards table from collision to collision instead of by a
+    fixed dt. Collision times are exact, so fast balls cannot tunnel and no work
+    is spent on steps where nothing happens.
+    """
+    def __init__(self, table):
+        # Table whose ball state is advanced
+        self.table = table
+
+        # Number of collisions of each ball, events predicted with an older
+        # count are stale and skipped when they come off the queue
+        self.count = np.zeros(len(table.ball), dtype=int)
+
+        # Priority queue of (time, tie breaker, i, j, dir, count_i, count_j),
+        # j is -1 for a wall event in direction dir
+        self.queue = []
+        self.tie = itertools.count()
+
+        # Number of collisions handled
+        self.n_events = 0
+
+        #predicts the first collisions, each pair of balls once
+        for i in range(len(table.ball)):
+            self.predict(i, np.arange(i+1, len(table.ball)))
+
+    def predict(self, i, others):
+        """
+        Computes the next wall collision of ball i and its collisions with the
+        balls in others, and adds them to the queue
+        Input: self, i [int], others [1D int np array]
+        Output: None
+        Usage: predict(0, np.arange(1, 5))
+        Returns: None
+        """
+        table = self.table
+        now = table.current_time
+        pos = table.pos[i]
+        vel = table.vel[i]
+        r = table.radius[i]
+
+        #time until the ball touches the wall it is moving towards
+        for dir, size in ((0, table.width), (1, table.height)):
+            if vel[dir] > 0:
+                dt = (size - r - pos[dir]) / vel[dir]
+            elif vel[dir] < 0:
+                dt = (r - pos[dir]) / vel[dir]
+            else:
+                continue
+            heapq.heappush(self.queue, (now + max(dt, 0), next(self.tie), i, -1, dir, self.count[i], 0))
+
+        if len(others) == 0:
+            return
+
+        #time until the distance between the centres equals the sum of the radii
+        dp = table.pos[others] - pos
+        dv = table.vel[others] - vel
+        b = (dp*dv).sum(axis=1)
+        dvdv = (dv*dv).sum(axis=1)
+        dpdp = (dp*dp).sum(axis=1)
+        sigma = table.radius[others] + r
+        disc = b*b - dvdv*(dpdp - sigma*sigma)
+        #only balls that are approaching each other and whose paths meet
+        approach = (b < 0) & (disc >= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dt = -(b + np.sqrt(disc)) / dvdv
+        #balls that already overlap and approach collide right away
+        dt = np.where(dpdp < sigma*sigma, 0, dt)
+
+        for k in np.nonzero(approach)[0]:
+            j = others[k]
+            heapq.heappush(self.queue, (now + max(dt[k], 0), next(self.tie), i, j, 0, self.count[i], self.count[j]))
+
+    def move(self, t):
+        """
+        Moves all balls in free flight to time t, without handling collisions
+        Input: self, t [float]
+        Output: None
+        Usage: move(2.5)
+        Returns: None
+        """
+        self.table.pos += self.table.vel*(t - self.table.current_time)
+        self.table.current_time = t
+
+    def next_event(self):
+        """
+        Time of the next valid collision, dropping stale events from the queue
+        Input: self
+        Output: float, inf if no collision is left
+        Usage: next_event()
+        Returns: 3.6225333564106212
+        """
+        while self.queue:
+            t, tie, i, j, dir, count_i, count_j = self.queue[0]
+            #events of balls that collided since the event was predicted are stale
+            if count_i == self.count[i] and (j < 0 or count_j == self.count[j]):
+                return t
+            heapq.heappop(self.queue)
+        return np.inf
+
+    def step(self):
+        """
+        Handles the next valid collision on the queue
+        Input: self
+        Output: True if a collision was handled, False if the queue is empty
+        Usage: step()
+        Returns: True
+        """
+        if self.next_event() == np.inf:
+            return False
+        t, tie, i, j, dir, count_i, count_j = heapq.heappop(self.queue)
+
+        table = self.table
+        self.move(t)
+        everyone = np.arange(len(table.ball))
+        if j < 0:
+            table.ball[i].v_reflect(dir)
+            self.count[i] += 1
+            self.predict(i, everyone[everyone != i])
+        else:
+            table.ball[i].v_ball_collision(table.ball[j])
+            self.count[i] += 1
+            self.count[j] += 1
+            self.predict(i, everyone[everyone != i])
+            self.predict(j, everyone[(everyone != i) & (everyone != j)])
+        self.n_events += 1
+        return True
+
+    def advance(self, t):
+        """
+        Handles all collisions up to time t and moves the balls to time t
+        Input: self, t [float]
+        Output: None
+        Usage: advance(10)
+        Returns: None
+        """
+        while self.next_event() <= t:
+            self.step()
+        self.move(t)
+
+    def sample(self, times):
+        """
+        Positions of all balls at the requested output times
+        Input: self, times [1D np array], increasing and not before current_time
+        Output: positions [len(times) x N x 2 np array]
+        Usage: sample(np.linspace(0, 10, 101))
+        Returns: array of positions, one N x 2 block per output time
+        """
+        times = np.asarray(times, dtype=float)
+        #free flight cannot be run backwards through collisions that were already handled
+        if len(times) and times[0] < self.table.current_time:
+            raise ValueError("times must not be before current_time")
+        if np.any(np.diff(times) < 0):
+            raise ValueError("times must be increasing")
+        positions = np.zeros((len(times), len(self.table.ball), 2))
+        for k in range(len(times)):
+            self.advance(times[k])
+            positions[k] = self.table.pos
+        return positions
+
+class BilliardsEnsemble(object):
+    """ Many independent billiard tables with the same size and balls, advanced
+    together in (tables x balls x 2) arrays. Only aggregate statistics are kept.
+    """
+    def __init__(self, h, w, pos, vel, radius=0.5, bins=(20,20)):
+        # Billiard table parameters, shared by all tables
+        self.current_time = 0
+        self.height = h
+        self.width = w
+
+        # Ball state, one block of rows per table
+        self.pos = np.array(pos, dtype=float, order='C')
+        self.vel = np.array(vel, dtype=float, order='C')
+        n_tables, n_balls = self.pos.shape[:2]
+        self.radius = np.broadcast_to(np.asarray(radius, dtype=float), (n_balls,)).copy()
+
+        # Collision counts per table, a wall hit is counted when the ball moves into the
+        # wall and a ball pair when the balls move towards each other
+        self.wall_collisions = np.zeros(n_tables, dtype=int)
+        self.ball_collisions = np.zeros(n_tables, dtype=int)
+
+        # Histogram of ball positions over all tables and recorded steps
+        self.bins = bins
+        self.histogram = np.zeros(bins, dtype=int)
+
+    def update(self, dt):
+        """
+        Updates all tables by one time step
+        Input: self, dt
+        Output: None
+        Usage: update(.01)
+        Returns: None
+        """
+        # Continuous update of all balls on all tables
+        self.pos += self.vel*dt
+
+        #discrete transitions
+        self.handle_collide_walls()
+        self.handle_collide_balls()
+
+        # Update time
+        self.current_time = self.current_time + dt
+
+    def handle_collide_walls(self):
+        """
+        Reflects the velocity of every ball that hits a wall, on every table
+        Input: self
+        Output: None
+        Usage: handle_collide_walls()
+        Returns: None
+        """
+        x = self.pos[:,:,0]
+        y = self.pos[:,:,1]
+        vx = self.vel[:,:,0]
+        vy = self.vel[:,:,1]
+        right = x > self.width-self.radius
+        left = x < self.radius
+        top = y > self.height-self.radius
+        bottom = y < self.radius
+        hit_x = right | left
+        #like Billiards.check_collide_walls, side walls take priority
+        hit_y = (top | bottom) & ~hit_x
+        #a ball that stays past a wall for several steps is only counted while it moves into the wall
+        into_x = hit_x & ((right & (vx > 0)) | (left & (vx < 0)))
+        into_y = hit_y & ((top & (vy > 0)) | (bottom & (vy < 0)))
+        self.wall_collisions += into_x.sum(axis=1) + into_y.sum(axis=1)
+        vx[hit_x] = -vx[hit_x]
+        vy[hit_y] = -vy[hit_y]
+
+    def handle_collide_balls(self):
+        """
+        Finds the overlapping balls of all tables with one spatial hash and changes
+        their velocities, with the same result as Billiards.handle_collide_balls
+        Input: self
+        Output: None
+        Usage: handle_collide_balls()
+        Returns: None
+        """
+        n_tables, n_balls = self.pos.shape[:2]
+        #all tables as one list of balls, the spatial hash keeps the tables apart. The arrays are
+        #C ordered (see __init__), so these are views and velocity updates reach self.vel
+        pos = self.pos.reshape(-1, 2)
+        vel = self.vel.reshape(-1, 2)
+        table = np.repeat(np.arange(n_tables), n_balls)
+        i, j = _overlapping_pairs(pos, np.tile(self.radius, n_tables), self.width, self.height, table)
+
+        #pairs are resolved in rounds. A pair is ready once no earlier pair that is still waiting
+        #shares one of its balls, so the ready pairs are independent and the result is the same as
+        #handling the pairs one by one in order
+        while len(i):
+            k = np.arange(len(i))
+            first = np.full(len(pos), len(i))
+            np.minimum.at(first, i, k)
+            np.minimum.at(first, j, k)
+            ready = (first[i] == k) & (first[j] == k)
+            a = i[ready]
+            b = j[ready]
+            i = i[~ready]
+            j = j[~ready]
+
+            #equal masses exchange their velocities along the collision direction
+            collision_dir = (pos[b] - pos[a]) / np.linalg.norm(pos[b] - pos[a], axis=1)[:,None]
+            v_a_init = (vel[a]*collision_dir).sum(axis=1)[:,None]
+            v_b_init = (vel[b]*collision_dir).sum(axis=1)[:,None]
+            #an overlapping pair is counted while the balls approach each other, not every step it overlaps
+            approaching = (v_a_init > v_b_init)[:,0]
+            self.ball_collisions += np.bincount(table[a[approaching]], minlength=n_tables)
+            vel[a] = vel[a] + (v_b_init - v_a_init)*collision_dir
+            vel[b] = vel[b] + (v_a_init - v_b_init)*collision_dir
+
+    def record_histogram(self):
+        """
+        Adds the current ball positions of all tables to the position histogram
+        Input: self
+        Output: None
+        Usage: record_histogram()
+        Returns: None
+        """
+        nx, ny = self.bins
+        ix = np.clip((self.pos[:,:,0]/self.width*nx).astype(int), 0, nx-1)
+        iy = np.clip((self.pos[:,:,1]/self.height*ny).astype(int), 0, ny-1)
+        self.histogram += np.bincount((ix*ny + iy).ravel(), minlength=nx*ny).reshape(nx, ny)
+
+    def simulate(self, n_steps, dt, hist_every=1):
+        """
+        Runs n_steps updates of all tables, recording the position histogram every hist_every steps
+        Input: self, n_steps [int], dt [float], hist_every [int]
+        Output: None
+        Usage: simulate(100, 0.1)
+        Returns: None
+        """
+        for step in range(1, n_steps+1):
+            self.update(dt)
+            if step % hist_every == 0:
+                self.record_histogram()
+
+def _run_ensemble_chunk(args):
+    #runs one block of tables, in a worker process when run_ensemble uses a pool
+    h, w, pos, vel, radius, bins, n_steps, dt, hist_every = args
+    ensemble = BilliardsEnsemble(h, w, pos, vel, radius, bins)
+    ensemble.simulate(n_steps, dt, hist_every)
+    return ensemble.wall_collisions, ensemble.ball_collisions, ensemble.histogram
+
+def run_ensemble(h, w, pos, vel, n_steps, dt, radius=0.5, bins=(20,20), hist_every=1, processes=1, chunk_size=256):
+    """
+    Simulates many independent tables and returns aggregate statistics
+    Inputs: h, w [float], table size
+            pos, vel [tables x N x 2 np arrays], initial state of every table
+            n_steps [int], dt [float]
+            radius [float or 1D np array], same balls on every table
+            bins [tuple of int], histogram bins in x and y
+            hist_every [int], record the histogram every k-th step
+            processes [int], worker processes, 1 runs in this process
+            chunk_size [int], tables per block handed to a worker
+    Output: dict with wall_collisions and ball_collisions per table, histogram,
+            x_edges and y_edges
+    Usage: run_ensemble(10, 10, pos, vel, 100, 0.1, processes=4)
+        Returns: {'wall_collisions': array([3, 5, ...]), ...}
+    """
+    pos = np.asarray(pos, dtype=float)
+    vel = np.asarray(vel, dtype=float)
+    blocks = [(h, w, pos[k:k+chunk_size], vel[k:k+chunk_size], radius, bins, n_steps, dt, hist_every)
+              for k in range(0, len(pos), chunk_size)]
+
+    #runs the blocks here or on a process pool
+    if processes == 1:
+        results = [_run_ensemble_chunk(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_run_ensemble_chunk, blocks))
+
+    #merges the blocks
+    return {
+        'wall_collisions': np.concatenate([r[0] for r in results]),
+        'ball_collisions': np.concatenate([r[1] for r in results]),
+        'histogram': sum(r[2] for r in results),
+        'x_edges': np.linspace(0, w, bins[0]+1),
+        'y_edges': np.linspace(0, h, bins[1]+1),
+    }
+
+def benchmark_collide_balls(counts=(100,200,400,800,1600,3200,6400), density=0.2, max_all_pairs=800, repeats=3):
+    """
+    Times handle_collide_balls with the spatial hash and with all pairs
+    Inputs: counts [tuple of int], numbers of balls
+            density [float], fraction of the table covered by balls
+            max_all_pairs [int], largest ball count timed with all pairs
+            repeats [int], best of this many runs is reported
+    Output: printed table of times per call (s)
+    Usage: benchmark_collide_balls((100,200))
+        Returns: None
+    """
+    rng = np.random.default_rng(0)
+    print("   balls   spatial hash      all pairs")
+    for n in counts:
+        #table grows with the ball count so the density stays fixed
+        side = np.sqrt(n*np.pi*0.5**2/density)
+        table = Billiards(side, side)
+        table.store_arrays(rng.uniform(0.5, side-0.5, (n,2)), rng.normal(size=(n,2)))
+        vel = table.vel.copy()
+
+        times = []
+        for broad_phase in (True, False):
+            if not broad_phase and n > max_all_pairs:
+                times.append(np.nan)
+                continue
+            table.broad_phase = broad_phase
+            best = np.inf
+            for r in range(repeats):
+                table.vel[:] = vel
+                start = time.perf_counter()
+                table.handle_collide_balls()
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+        print(f"{n:8d} {times[0]:14.6f} {times[1]:14.6f}")
+
+def main():
+    """
+    Interactive simulation: asks for the balls and animates the table
+    Input: None
+    Output: None
+    Usage: main()
+    Returns: None
+    """
+    import matplotlib.pyplot as plt
+
+    # Initialize
+    billiard_sim = Billiards(10,10)
+    billiard_sim.setup_animation()
+    billiard_sim.add_ball()
+
+    # Simulate
+    dt = 0.1
+    Tf = 10
+    start = time.perf_counter()
+    while (billiard_sim.current_time < Tf) and (not billiard_sim.is_closed()):
+        billiard_sim.update(dt)
+
+        #keeps the simulation at wall-clock speed, the renderer draws at its own frame rate
+        ahead = billiard_sim.current_time - (time.perf_counter() - start)
+        if ahead > 0:
+            billiard_sim.fig.canvas.start_event_loop(ahead)
+    billiard_sim.redraw()
+
+    plt.title('Simulation complete. Close the figure to exit')
+    while not billiard_sim.is_closed():
+        plt.pause(1)
+
+if __name__ == "__main__":
+    main()
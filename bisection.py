@@ -3,24 +3,16 @@
 #Program Description: Locates zeros of data through bisection method of searching through an interval
 
 #import modules
-import matplotlib.pyplot as plt
 import numpy as np
 import math
 
-#load data files
-data = np.load("snapthrough.npy")
-
-#slicing data to get all the values in the first column [mm]
-z = data[:,0]
-#get all the values in the second column [N]
-force = data[:,1] 
-
 #function to call bisection method
-def bisection(z,force):
+def bisection(z,force,interval=(-10,5)):
     """
         This function locates the z value at which the force cross zero with a negative slope
         Inputs: z [1D np array]
                 force [1D np array]
+                interval [sequence], first and last entries are the ends of the searched interval
         Outputs: float 
         Usage: bisection(-10,5)
                 returns: "There is a zero at z=-4.2965 "
@@ -80,6 +72,182 @@ def interpolate(z, force, zs):
     fs = (force_right - force_left)/(z_right-z_left) * (zs - z_left) + force_left #formula for linear interpolation
     return fs
 
-#set interval that function checks
-interval=np.arange(-10,6) #interval from -10,6
-bisection(z,force)
+class LinearInterpolator(object):
+    """
+    Piecewise-linear interpolation table for one (z, force) curve. The slope and
+    intercept of every segment are computed once, so each batch of queries costs
+    one searchsorted and one multiply-add.
+    Inputs: z, [1d np array], height data (mm), sorted
+            force, [1d np array], force data (N)
+            fill_value, [float or None], force returned outside [z[0], z[-1]],
+                        None extrapolates the first/last segment
+    Usage: LinearInterpolator(z, force)(np.array([10.0, 11.0]))
+            returns array([0.62576147, ...])
+    """
+    def __init__(self, z, force, fill_value=np.nan):
+        self.z = np.asarray(z, dtype=float)
+        force = np.asarray(force, dtype=float)
+        self.fill_value = fill_value
+        #slope and intercept of the line through each segment
+        self.slope = np.diff(force)/np.diff(self.z)
+        self.intercept = force[:-1] - self.slope*self.z[:-1]
+
+    def __call__(self, zs):
+        zs = np.asarray(zs, dtype=float)
+        #segment of every query, queries outside the data use the end segments
+        k = np.clip(np.searchsorted(self.z, zs, 'right') - 1, 0, len(self.slope) - 1)
+        fs = self.slope[k]*zs + self.intercept[k]
+        if self.fill_value is not None:
+            fs = np.where((zs < self.z[0]) | (zs > self.z[-1]), self.fill_value, fs)
+        return fs[()]
+
+def find_zeros(z, force, negative_slope=True):
+    """
+    This function locates every z value at which the force crosses zero, in one pass over the data
+    Inputs: z, [1d np array], height data (mm), sorted
+            force, [1d np array], force data (N)
+            negative_slope, [bool], only crossings where the force goes from positive to negative,
+                            False finds every crossing
+    Output: zeros, [1d np array], z values of the crossings in increasing order (mm)
+    Usage: find_zeros(z, force)
+            returns array([-4.2965...])
+    """
+    z = np.asarray(z, dtype=float)
+    force = np.asarray(force, dtype=float)
+    #exact zeros are skipped, so a crossing is a sign change between neighbouring nonzero samples
+    #and a curve that only touches zero is not a crossing
+    nonzero = np.nonzero(force)[0]
+    left = nonzero[:-1]
+    right = nonzero[1:]
+    #samples that go from positive to negative
+    crossing = (force[left] > 0) & (force[right] < 0)
+    if not negative_slope:
+        #adds samples that go from negative to positive
+        crossing |= (force[left] < 0) & (force[right] > 0)
+    a = left[crossing]
+    b = right[crossing]
+    #neighbouring samples are solved with the interpolating line, the same line interpolate uses,
+    #otherwise the force is exactly zero in between and the first zero sample is the crossing
+    line = z[a] - force[a]*(z[b] - z[a])/(force[b] - force[a])
+    zeros = np.where(b == a + 1, line, z[a + 1])
+    return zeros
+
+class ZeroIndex(object):
+    """
+    Index of the zero crossings of one (z, force) curve for answering many interval
+    queries. The crossings are found once and kept sorted, so the position of a
+    query endpoint in that array is the number of crossings before it and every
+    query is two binary searches.
+    Inputs: z, [1d np array], height data (mm), sorted
+            force, [1d np array], force data (N)
+            negative_slope, [bool], only index crossings where the force goes from positive to negative
+    Usage: ZeroIndex(z, force).count(np.array([-10, 0]), np.array([6, 6]))
+            returns array([1, 0])
+    """
+    def __init__(self, z, force, negative_slope=True):
+        #z values of all crossings, in increasing order
+        self.zeros = find_zeros(z, force, negative_slope)
+
+    def bounds(self, a, b):
+        """
+        Range of crossings inside each window [a, b]
+        Inputs: a, b, [float or np array], window ends (mm)
+        Output: lo, hi, [int or np array], the crossings of window k are zeros[lo[k]:hi[k]]
+        Usage: bounds(-10, 6)
+                returns (0, 1)
+        """
+        #number of crossings before a and up to b
+        lo = np.searchsorted(self.zeros, a, 'left')
+        hi = np.maximum(np.searchsorted(self.zeros, b, 'right'), lo)
+        return lo, hi
+
+    def count(self, a, b):
+        """
+        Number of crossings in each window [a, b]
+        Inputs: a, b, [float or np array], window ends (mm)
+        Output: [int or np array]
+        Usage: count(-10, 6)
+                returns 1
+        """
+        lo, hi = self.bounds(a, b)
+        return hi - lo
+
+    def contains(self, a, b):
+        """
+        Whether each window [a, b] has a crossing
+        Inputs: a, b, [float or np array], window ends (mm)
+        Output: [bool or np array]
+        Usage: contains(-10, 6)
+                returns True
+        """
+        return self.count(a, b) > 0
+
+    def first(self, a, b):
+        """
+        First crossing in each window [a, b], nan where there is none
+        Inputs: a, b, [float or np array], window ends (mm)
+        Output: [float or np array], z values (mm)
+        Usage: first(-10, 6)
+                returns -4.2965...
+        """
+        lo, hi = self.bounds(a, b)
+        #pads the crossings with nan so empty windows can index past the end
+        padded = np.append(self.zeros, np.nan)
+        return np.where(hi > lo, padded[lo], np.nan)[()]
+
+    def zeros_in(self, a, b):
+        """
+        All crossings in one window [a, b]
+        Inputs: a, b, [float], window ends (mm)
+        Output: [1d np array], z values (mm)
+        Usage: zeros_in(-10, 6)
+                returns array([-4.2965...])
+        """
+        lo, hi = self.bounds(a, b)
+        return self.zeros[lo:hi]
+
+def iter_zeros(path, chunk_size=1000000, negative_slope=True):
+    """
+    This function finds the zero crossings of a force file without loading it into memory,
+    scanning a memory-mapped view of it one chunk at a time
+    Inputs: path, [str], .npy file with z (mm) in the first column and force (N) in the second
+            chunk_size, [int], rows read at a time
+            negative_slope, [bool], only crossings where the force goes from positive to negative
+    Output: generator of floats, z values of the crossings in increasing order (mm)
+    Usage: list(iter_zeros("snapthrough.npy"))
+            returns [-4.2965...]
+    """
+    data = np.load(path, mmap_mode='r')
+    carry = np.zeros((0, 2))
+    for start in range(0, len(data), chunk_size):
+        #prepends the rows carried over so a crossing across the chunk boundary is checked too
+        block = np.concatenate([carry, data[start:start+chunk_size]])
+        yield from find_zeros(block[:,0], block[:,1], negative_slope)
+        #the last nonzero sample can still form a crossing with the next chunk, and if zeros follow it
+        #the first of them is where that crossing would be, so at most two rows are carried
+        nonzero = np.nonzero(block[:,1])[0]
+        carry = block[nonzero[-1]:nonzero[-1]+2] if len(nonzero) else block[:0]
+
+def main():
+    """
+    Looks for a zero of the snapthrough data between z=-10 and z=5
+    Input: None
+    Output: printed result of bisection
+    Usage: main()
+        Returns: None
+    """
+    #load data files
+    data = np.load("snapthrough.npy")
+
+    #slicing data to get all the values in the first column [mm]
+    z = data[:,0]
+    #get all the values in the second column [N]
+    force = data[:,1] 
+
+    #set interval that function checks
+    interval=np.arange(-10,6) #interval from -10,6
+    bisection(z,force,interval)
+
+if __name__ == "__main__":
+    main()
+
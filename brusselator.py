@@ -1,8 +1,8 @@
 #import modules
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.integrate import solve_ivp
-from scipy.optimize import least_squares
+#matplotlib and scipy are imported by the functions that use them, so importing this module stays cheap
 
 def brusselator_MC(X0, Tfinal):
     #creates list of molecule numbers
@@ -61,20 +61,399 @@ def brusselator_MC(X0, Tfinal):
         tf.append(T)
     return tf, X
 
-def brusselator_ODE(X0, tf, kX1, kX2, k3, k4):
-    def brusselator_dyn(t, X, kX1, kX2, k3, k4):
-        #calculates derivatives
-        Y1 = X[0]
-        Y2 = X[1]
-        dY1 = kX1 - kX2*Y1 + k3*Y1*Y1*Y2 - k4*Y1
-        dY2 = kX2*Y1-k3*Y1*Y1*Y2
-        return np.array([dY1, dY2])
-    
+# Change in (Y1, Y2) caused by each of the four reactions
+STOICHIOMETRY = ((1, 0), (-1, 1), (1, -1), (-1, 0))
+
+def brusselator_SSA(X0, Tfinal, c1X1=5000, c2X2=50, c3=.00005, c4=5, seed=None, block=65536, t_out=None):
+    """
+    Gillespie simulation of the brusselator, same reactions as brusselator_MC but
+    with random numbers drawn in blocks and results written into preallocated arrays
+    Inputs: X0 [list], initial numbers of Y1 and Y2 molecules
+            Tfinal [float], final time (s)
+            c1X1, c2X2, c3, c4 [float], reaction rate parameters
+            seed [int or np.random.Generator], random stream
+            block [int], random numbers drawn at a time and initial array length
+            t_out [1D np array], increasing output times in [0, Tfinal] (s), None records every event
+    Outputs: t [1D float64 np array], event times, or t_out
+             X [N x 2 int32 np array], molecule numbers after each event, or at the times in t_out
+    Usage: brusselator_SSA([1000,2000], 14, seed=0, t_out=np.linspace(0, 14, 141))
+        Returns: (array([0, 0.1, ...]), array([[1000, 2000], [1431, 1735], ...]))
+    """
+    rng = np.random.default_rng(seed)
+
+    if t_out is None:
+        #preallocated results, doubled in size when full
+        t = np.zeros(block)
+        X = np.zeros((block, 2), dtype=np.int32)
+        X[0] = X0
+        n = 1
+    else:
+        #only the state at the output times is kept
+        t_out = np.asarray(t_out, dtype=float)
+        X_out = np.zeros((len(t_out), 2), dtype=np.int32)
+        out_times = t_out.tolist() + [np.inf]
+        j = 0
+
+    #current state
+    T = 0.0
+    Y1 = int(X0[0])
+    Y2 = int(X0[1])
+
+    while T < Tfinal:
+        #waiting times of rate 1 and uniform numbers to pick reactions, one block at a time
+        waits = rng.standard_exponential(block).tolist()
+        picks = rng.random(block).tolist()
+
+        for k in range(block):
+            #cumulative propensities of reactions 1 to 4
+            a_1 = c1X1
+            a_12 = a_1 + c2X2*Y1
+            a_123 = a_12 + c3*Y1*(Y1-1)/2*Y2
+            a_0 = a_123 + c4*Y1
+
+            #time of the next reaction
+            T += waits[k]/a_0
+
+            if t_out is not None:
+                #output times before the reaction see the current state
+                while out_times[j] < T:
+                    X_out[j,0] = Y1
+                    X_out[j,1] = Y2
+                    j += 1
+
+            #first reaction whose cumulative propensity exceeds the pick
+            r = picks[k]*a_0
+            if r < a_1:
+                dY1, dY2 = STOICHIOMETRY[0]
+            elif r < a_12:
+                dY1, dY2 = STOICHIOMETRY[1]
+            elif r < a_123:
+                dY1, dY2 = STOICHIOMETRY[2]
+            else:
+                dY1, dY2 = STOICHIOMETRY[3]
+            Y1 += dY1
+            Y2 += dY2
+
+            if t_out is None:
+                if n == len(t):
+                    t = np.concatenate([t, np.zeros(n)])
+                    X = np.concatenate([X, np.zeros((n, 2), dtype=np.int32)])
+                t[n] = T
+                X[n,0] = Y1
+                X[n,1] = Y2
+                n += 1
+
+            if T >= Tfinal:
+                break
+
+    if t_out is None:
+        return t[:n], X[:n]
+    #output times not before the last reaction see the final state
+    X_out[j:] = (Y1, Y2)
+    return t_out, X_out
+
+def brusselator_tau_leap(X0, Tfinal, c1X1=5000, c2X2=50, c3=.00005, c4=5, epsilon=0.03, n_ssa=100, seed=None, t_out=None):
+    """
+    Approximate simulation of the brusselator by tau-leaping: each leap fires a
+    Poisson number of every reaction. The leap is chosen so that no propensity
+    changes by more than about epsilon (Cao, Gillespie and Petzold 2006). When a
+    leap would cover only a few reactions, n_ssa exact Gillespie steps are taken instead.
+    Inputs: X0 [list], initial numbers of Y1 and Y2 molecules
+            Tfinal [float], final time (s)
+            c1X1, c2X2, c3, c4 [float], reaction rate parameters
+            epsilon [float], accuracy of the leaps, smaller is more accurate and slower
+            n_ssa [int], exact steps taken when leaping does not pay off
+            seed [int or np.random.Generator], random stream
+            t_out [1D np array], increasing output times in [0, Tfinal] (s), None records every step
+    Outputs: t [1D float64 np array], times of the leaps and exact steps, or t_out
+             X [N x 2 int32 np array], molecule numbers at those times
+    Usage: brusselator_tau_leap([1000,2000], 14, seed=0)
+        Returns: (array([0, 0.0012, ...]), array([[1000, 2000], [1004, 1996], ...]))
+    """
+    rng = np.random.default_rng(seed)
+
+    if t_out is None:
+        #preallocated results, doubled in size when full
+        t = np.zeros(4096)
+        X = np.zeros((4096, 2), dtype=np.int32)
+        X[0] = X0
+        n = 1
+    else:
+        #only the state at the output times is kept
+        t_out = np.asarray(t_out, dtype=float)
+        X_out = np.zeros((len(t_out), 2), dtype=np.int32)
+        out_times = t_out.tolist() + [np.inf]
+        j = 0
+
+    #current state
+    T = 0.0
+    Y1 = int(X0[0])
+    Y2 = int(X0[1])
+
+    while T < Tfinal:
+        #state before this leap or batch of exact steps
+        Y1_before = Y1
+        Y2_before = Y2
+
+        #propensities of reactions 1 to 4
+        a_1 = c1X1
+        a_2 = c2X2*Y1
+        a_3 = c3*Y1*(Y1-1)/2*Y2
+        a_4 = c4*Y1
+        a_0 = a_1 + a_2 + a_3 + a_4
+
+        #mean and variance of the change of Y1 and Y2 per unit time
+        mu1 = a_1 - a_2 + a_3 - a_4
+        mu2 = a_2 - a_3
+        var1 = a_0
+        var2 = a_2 + a_3
+        #largest allowed change of each species, Y1 enters reaction 3 (third order) twice, Y2 once
+        g1 = 1.5*(2 + 1/(Y1-1)) if Y1 > 1 else 3.0
+        bound1 = max(epsilon*Y1/g1, 1)
+        bound2 = max(epsilon*Y2/3, 1)
+        tau = min(bound1/abs(mu1) if mu1 else np.inf, bound1**2/var1,
+                  bound2/abs(mu2) if mu2 else np.inf, bound2**2/var2 if var2 else np.inf)
+
+        if tau*a_0 < 10:
+            #too few reactions per leap, exact steps are cheaper and exact
+            waits = rng.standard_exponential(n_ssa).tolist()
+            picks = rng.random(n_ssa).tolist()
+            steps = []
+            for k in range(n_ssa):
+                a_12 = c1X1 + c2X2*Y1
+                a_123 = a_12 + c3*Y1*(Y1-1)/2*Y2
+                a_0 = a_123 + c4*Y1
+                T += waits[k]/a_0
+                r = picks[k]*a_0
+                dY1, dY2 = STOICHIOMETRY[0 if r < c1X1 else 1 if r < a_12 else 2 if r < a_123 else 3]
+                Y1 += dY1
+                Y2 += dY2
+                steps.append((T, Y1, Y2))
+                if T >= Tfinal:
+                    break
+        else:
+            #fires a Poisson number of each reaction, halving the leap if a count goes negative
+            tau = min(tau, Tfinal - T)
+            while True:
+                k1, k2, k3, k4 = rng.poisson((a_1*tau, a_2*tau, a_3*tau, a_4*tau)).tolist()
+                Y1_new = Y1 + k1 - k2 + k3 - k4
+                Y2_new = Y2 + k2 - k3
+                if Y1_new >= 0 and Y2_new >= 0:
+                    break
+                tau = tau/2
+            T += tau
+            Y1 = Y1_new
+            Y2 = Y2_new
+            steps = [(T, Y1, Y2)]
+
+        if t_out is not None:
+            #output times before each step see the state before it
+            for T_step, Y1_step, Y2_step in steps:
+                while out_times[j] < T_step:
+                    X_out[j,0] = Y1_before
+                    X_out[j,1] = Y2_before
+                    j += 1
+                Y1_before = Y1_step
+                Y2_before = Y2_step
+            continue
+
+        if n + len(steps) > len(t):
+            #doubles, or grows further when a batch of exact steps is longer than that
+            extra = max(len(t), n + len(steps) - len(t))
+            t = np.concatenate([t, np.zeros(extra)])
+            X = np.concatenate([X, np.zeros((extra, 2), dtype=np.int32)])
+        for T_step, Y1_step, Y2_step in steps:
+            t[n] = T_step
+            X[n,0] = Y1_step
+            X[n,1] = Y2_step
+            n += 1
+
+    if t_out is None:
+        return t[:n], X[:n]
+    #output times not before the last step see the final state
+    X_out[j:] = (Y1, Y2)
+    return t_out, X_out
+
+def benchmark_tau_leap(X0=[1000,2000], Tf=14, n_runs=10, epsilons=(0.03, 0.1, 0.3)):
+    """
+    Compares tau-leaping with the exact simulation in speed and accuracy. The error
+    is the RMS difference of the ensemble-mean trajectories on a 0.1 s grid,
+    relative to the RMS spread between exact runs. The error of a second set of
+    exact runs shows the sampling noise of the comparison.
+    Inputs: X0 [list], initial numbers of Y1 and Y2 molecules
+            Tf [float], final time (s)
+            n_runs [int], runs of each method
+            epsilons [tuple of float], tau-leaping accuracies to try
+    Outputs: printed table of time per run, steps per run and relative error
+    Usage: benchmark_tau_leap(n_runs=5)
+        Returns: None
+    """
+    grid = np.arange(0, Tf, 0.1)
+
+    def run(method, first_seed=0, **kwargs):
+        #runs n_runs seeds and samples each trajectory on the grid
+        samples = np.zeros((n_runs, len(grid), 2))
+        steps = 0
+        start = time.perf_counter()
+        for k in range(n_runs):
+            t, X = method(X0, Tf, seed=first_seed+k, **kwargs)
+            samples[k] = X[np.searchsorted(t, grid, 'right') - 1]
+            steps += len(t)
+        return samples, (time.perf_counter() - start)/n_runs, steps/n_runs
+
+    exact, exact_time, exact_steps = run(brusselator_SSA)
+    spread = np.sqrt(np.mean(exact.var(axis=0)))
+
+    def error(samples):
+        return np.sqrt(np.mean((samples.mean(axis=0) - exact.mean(axis=0))**2))/spread
+
+    print("     method   time/run (s)   steps/run   error")
+    print(f"{'SSA':>11} {exact_time:14.3f} {exact_steps:11.0f} {'-':>7}")
+    other, other_time, other_steps = run(brusselator_SSA, first_seed=n_runs)
+    print(f"{'SSA again':>11} {other_time:14.3f} {other_steps:11.0f} {error(other):7.3f}")
+    for epsilon in epsilons:
+        leap, leap_time, leap_steps = run(brusselator_tau_leap, first_seed=2*n_runs, epsilon=epsilon)
+        print(f"{'tau '+str(epsilon):>11} {leap_time:14.3f} {leap_steps:11.0f} {error(leap):7.3f}")
+
+def _run_brusselator_chunk(args):
+    #runs one block of seeds, in a worker process when brusselator_ensemble uses a pool
+    method, X0, Tf, t_grid, seeds, keep_runs, kwargs = args
+    #running count, mean and sum of squared deviations (Welford)
+    count = 0
+    mean = np.zeros((len(t_grid), 2))
+    M2 = np.zeros((len(t_grid), 2))
+    runs = []
+    for seed in seeds:
+        #only the grid is recorded, so memory does not grow with the number of events
+        t, sample = method(X0, Tf, seed=seed, t_out=t_grid, **kwargs)
+        count += 1
+        delta = sample - mean
+        mean += delta/count
+        M2 += delta*(sample - mean)
+        if keep_runs:
+            runs.append(sample)
+    return count, mean, M2, runs
+
+def brusselator_ensemble(X0, Tf, n_runs, t_grid, seed=0, method=brusselator_SSA, processes=1, chunk_size=8, keep_runs=False, **kwargs):
+    """
+    Runs many independent stochastic simulations and returns their statistics on a
+    common time grid. Every run gets its own random stream spawned from one root
+    seed and the runs are merged in a fixed order, so the results do not depend on
+    the number of processes.
+    Inputs: X0 [list], initial numbers of Y1 and Y2 molecules
+            Tf [float], final time (s)
+            n_runs [int], number of runs
+            t_grid [1D np array], times at which the runs are compared (s)
+            seed [int], root seed
+            method [function], brusselator_SSA or brusselator_tau_leap
+            processes [int], worker processes, 1 runs in this process
+            chunk_size [int], runs per block handed to a worker
+            keep_runs [bool], also return every sampled run
+            kwargs, passed on to method
+    Outputs: dict with t (the grid), mean and var (len(t_grid) x 2 np arrays, sample
+             variance over runs) and, with keep_runs, runs (n_runs x len(t_grid) x 2)
+    Usage: brusselator_ensemble([1000,2000], 14, 100, np.linspace(0, 14, 141), processes=8)
+        Returns: {'t': array([0, 0.1, ...]), 'mean': array([[1000, 2000], ...]), 'var': ...}
+    """
+    t_grid = np.asarray(t_grid, dtype=float)
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+    blocks = [(method, X0, Tf, t_grid, seeds[k:k+chunk_size], keep_runs, kwargs)
+              for k in range(0, n_runs, chunk_size)]
+
+    #runs the blocks here or on a process pool
+    if processes == 1:
+        results = [_run_brusselator_chunk(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_run_brusselator_chunk, blocks))
+
+    #merges the block statistics in order (Chan et al.)
+    count, mean, M2, runs = results[0]
+    for count_b, mean_b, M2_b, runs_b in results[1:]:
+        total = count + count_b
+        delta = mean_b - mean
+        mean = mean + delta*count_b/total
+        M2 = M2 + M2_b + delta**2*count*count_b/total
+        count = total
+        runs = runs + runs_b
+
+    ensemble = {'t': t_grid, 'mean': mean, 'var': M2/max(count - 1, 1)}
+    if keep_runs:
+        ensemble['runs'] = np.array(runs)
+    return ensemble
+
+def brusselator_dyn(t, X, kX1, kX2, k3, k4):
+    #calculates derivatives
+    Y1 = X[0]
+    Y2 = X[1]
+    dY1 = kX1 - kX2*Y1 + k3*Y1*Y1*Y2 - k4*Y1
+    dY2 = kX2*Y1-k3*Y1*Y1*Y2
+    return np.array([dY1, dY2])
+
+def brusselator_jac(t, X, kX1, kX2, k3, k4):
+    #derivatives of brusselator_dyn with respect to Y1 (first column) and Y2 (second column)
+    Y1 = X[0]
+    Y2 = X[1]
+    return np.array([[-kX2 + 2*k3*Y1*Y2 - k4, k3*Y1*Y1],
+                     [kX2 - 2*k3*Y1*Y2, -k3*Y1*Y1]])
+
+def brusselator_sensitivity_dyn(t, Z, kX1, kX2, k3, k4):
+    #derivatives of the state Y1, Y2 and of its 2 x 4 sensitivity S = dX/dK,
+    #dS/dt = J S + df/dK with J from brusselator_jac
+    X = Z[:2]
+    S = Z[2:].reshape(2, 4)
+    Y1 = X[0]
+    Y2 = X[1]
+    dfdK = np.array([[1, -Y1, Y1*Y1*Y2, -Y1],
+                     [0, Y1, -Y1*Y1*Y2, 0]])
+    dS = brusselator_jac(t, X, kX1, kX2, k3, k4) @ S + dfdK
+    return np.concatenate([brusselator_dyn(t, X, kX1, kX2, k3, k4), dS.ravel()])
+
+def brusselator_ODE(X0, tf, kX1, kX2, k3, k4, method='RK45'):
+    from scipy.integrate import solve_ivp
+
+    #implicit methods use the analytic Jacobian instead of finite differences
+    options = {}
+    if method in ('Radau', 'BDF', 'LSODA'):
+        options['jac'] = brusselator_jac
+
     #integrates brusellator ODE
-    sol = solve_ivp(brusselator_dyn, (0,max(tf)), X0, args=(kX1,kX2,k3,k4), t_eval=tf)
+    sol = solve_ivp(brusselator_dyn, (0,max(tf)), X0, method=method, args=(kX1,kX2,k3,k4), t_eval=tf, **options)
     return sol.t, sol.y
 
+def brusselator_ODE_sensitivity(X0, tf, K, method='LSODA', rtol=1e-4, atol=1e-7):
+    """
+    Integrates the brusselator ODE together with its forward sensitivities, the
+    derivatives of the solution with respect to the parameters, in one solve
+    Inputs: X0 [list], initial concentrations
+            tf [1D np array], output times (s)
+            K [list], kX1, kX2, k3, k4
+            method, rtol, atol, passed to solve_ivp
+    Outputs: t [1D np array], output times reached
+             X [2 x N np array], concentrations
+             S [N x 2 x 4 np array], S[i,j,k] = dX[j](t[i])/dK[k]
+    Usage: brusselator_ODE_sensitivity([1,2], np.linspace(0, 14, 281), [9.5, 38, 13, 21.5])
+        Returns: (array([0, 0.05, ...]), array([[1, 1.29, ...], [2, 2.11, ...]]), array([[[0, 0, 0, 0], ...]]))
+    """
+    from scipy.integrate import solve_ivp
+
+    #the sensitivities start at zero since X0 does not depend on K
+    Z0 = np.concatenate([np.asarray(X0, dtype=float), np.zeros(8)])
+    sol = solve_ivp(brusselator_sensitivity_dyn, (0,max(tf)), Z0, method=method, args=tuple(K),
+                    t_eval=tf, rtol=rtol, atol=atol)
+    return sol.t, sol.y[:2], sol.y[2:].T.reshape(-1, 2, 4)
+
 def SOS_error(K, X0, tf, X):
+    """
+    Residuals between the brusselator ODE with parameters K and a stochastic run
+    Inputs: K [list], kX1, kX2, k3, k4
+            X0 [list], initial concentrations
+            tf [1D np array], times of the run (s), e.g. the t_out grid of brusselator_SSA
+            X [N x 2 np array], concentrations of the run at those times
+    Outputs: residual [1D np array], flattened ODE minus run
+    Usage: SOS_error([9.5, 38, 13, 21.5], [1,2], t, X)
+        Returns: array([0, 0, -0.012, ...])
+    """
     kX1 = K[0]
     kX2 = K[1]
     k3 = K[2]
@@ -86,47 +465,105 @@ def SOS_error(K, X0, tf, X):
     residual = Xode - X
     return residual.flatten()
 
+class SOSSensitivity(object):
+    """
+    Residuals of SOS_error together with their exact Jacobian d(residual)/dK, both
+    from one forward-sensitivity solve per parameter vector. least_squares asks for
+    the residuals and then the Jacobian at the same K, so the second call reuses
+    the solve of the first.
+    Inputs: X0 [list], initial concentrations
+            tf [1D np array], times of the run (s)
+            X [N x 2 np array], concentrations of the run at those times
+    Usage: fit = SOSSensitivity([1,2], t, X)
+           least_squares(fit.residual, K, jac=fit.jacobian)
+    """
+    def __init__(self, X0, tf, X):
+        self.X0 = X0
+        self.tf = tf
+        self.X = X
+        # Parameters of the last solve and its results
+        self.K = None
+        self.res = None
+        self.jac = None
+
+    def solve(self, K):
+        #solves again only for new parameters
+        if self.K is not None and np.array_equal(K, self.K):
+            return
+        (tode, Xode, S) = brusselator_ODE_sensitivity(self.X0, self.tf, K)
+        Xode = np.transpose(Xode)
+        if(Xode.shape != self.X.shape):
+            S = np.pad(S, ((0, self.X.shape[0]-S.shape[0]),(0,0),(0,0)), 'edge')
+            Xode = np.pad(Xode, ((0, self.X.shape[0]-Xode.shape[0]),(0,0)), 'edge')
+        self.K = np.array(K, dtype=float)
+        self.res = (Xode - self.X).flatten()
+        #rows in the same order as the flattened residuals
+        self.jac = S.reshape(-1, 4)
+
+    def residual(self, K):
+        self.solve(K)
+        return self.res
+
+    def jacobian(self, K):
+        self.solve(K)
+        return self.jac
+
+def main():
+    """
+    Plots Monte Carlo runs of the brusselator and fits the ODE parameters to one run
+    Input: None
+    Output: plots and printed fitted parameters
+    Usage: main()
+        Returns: None
+    """
+    import matplotlib.pyplot as plt
+    from scipy.optimize import least_squares
+
+    # Monte Carlo 10 runs
+    Niter = 10
+    #sets initial molecule numbers
+    X0 = [1000,2000]
+    #sets final time in seconds
+    Tf = 14
+
+    #for loop that runs Niter times
+    for i in range(Niter):
+        #sets results of run to t and x
+        (t, X) = brusselator_MC(X0, Tf)
+        #sets number of molecules to an array
+        X = np.array(X)
+        #plots each molecule amount
+        plt.plot(X[:,0], X[:,1], label = 'run '+str(i+1))
+    plt.xlabel('Y1')
+    plt.ylabel('Y2')
+    plt.legend()
+    plt.show()
+
+    # compare to ode
+    #records the run on a 0.05 s grid, so the fit only evaluates the ODE there
+    (t, X) = brusselator_SSA(X0, Tf, t_out=np.linspace(0, Tf, 281))
+    #divide by 1000 for concentrations
+    X = np.array(X)/1000
+    #parameters
+    K =  [9.5, 38, 13, 21.5]
+
+
+    # bonus
+    #sets parameters to fitted parameters
+    #exact gradients from the sensitivity equations instead of finite differences
+    fit = SOSSensitivity([1,2], t, X)
+    params = least_squares(fit.residual, K, jac=fit.jacobian)
+    K = params.x
+    print(K)
 
-# Monte Carlo 10 runs
-Niter = 10
-#sets initial molecule numbers
-X0 = [1000,2000]
-#sets final time in seconds
-Tf = 14
-
-#for loop that runs Niter times
-for i in range(Niter):
-    #sets results of run to t and x
-    (t, X) = brusselator_MC(X0, Tf)
-    #sets number of molecules to an array
-    X = np.array(X)
-    #plots each molecule amount
-    plt.plot(X[:,0], X[:,1], label = 'run '+str(i+1))
-plt.xlabel('Y1')
-plt.ylabel('Y2')
-plt.legend()
-plt.show()
-
-# compare to ode
-(t, X) = brusselator_MC(X0, Tf)
-#divide by 1000 for concentrations
-X = np.array(X)/1000
-#parameters
-K =  [9.5, 38, 13, 21.5]
-
-
-# bonus
-#sets parameters to fitted parameters
-params = least_squares(SOS_error, K, args=([1,2], t, X))
-K = params.x
-print(K)
-
-#plots results of ode and simulation
-(tode, Xode) = brusselator_ODE([1,2], t, K[0], K[1], K[2], K[3])
-plt.plot(X[:,0], X[:,1], label = 'MC')
-plt.plot(Xode[0], Xode[1], label = 'ODE')
-plt.xlabel('Y1')
-plt.ylabel('Y2')
-plt.legend()
-plt.show()
+    #plots results of ode and simulation
+    (tode, Xode) = brusselator_ODE([1,2], t, K[0], K[1], K[2], K[3])
+    plt.plot(X[:,0], X[:,1], label = 'MC')
+    plt.plot(Xode[0], Xode[1], label = 'ODE')
+    plt.xlabel('Y1')
+    plt.ylabel('Y2')
+    plt.legend()
+    plt.show()
 
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
 #import modules
-import matplotlib.pyplot as plt
+import os
+import time
+import hashlib
+import tempfile
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+#matplotlib is imported by the plotting functions, so importing this module stays cheap
 
 def SEIR(S, E, I , R , alpha, beta, gamma):
     """This function evaluates changes in populations of susceptible, exposed, infected, and recovered people
@@ -58,6 +65,89 @@ def integrate_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf):
     S=S_vec;E=E_vec;I=I_vec;R=R_vec;t=t_vec
     return S,E,I,R,t
 
+class SEIRCache(object):
+    """
+    Memoizes integrate_SEIR results keyed on the full parameter tuple, so figures and dashboards that ask for
+    the same scenario again are served without integrating. The most recently used results are kept in memory,
+    and when a directory is given every result is also stored there as an .npz file named by a hash of its
+    parameters, which lets other processes and later sessions reuse it. Files are written under a temporary name and
+    renamed into place, and one that cannot be read is recomputed.
+    Inputs: maxsize, [int], number of results kept in memory
+            path, [str or None], directory of the on-disk store, None keeps results in memory only
+    Usage: cache = SEIRCache(path="seir_cache"); t, Y = cache(.9,0,.1,0,1, .5, .3, .01, 1000, zeta=.01)
+    """
+    def __init__(self, maxsize=32, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta=0, record_every=1):
+        #floats, so that 1 and 1.0 are the same scenario
+        return tuple(float(v) for v in (S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta)) + (int(record_every),)
+
+    def file(self, key):
+        #.npz file of a key in the on-disk store
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+    def __call__(self, S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta=0, record_every=1):
+        """
+        Same inputs and outputs as integrate_SEIR. The returned arrays are shared with the cache and read-only.
+        """
+        key = self.key(S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta, record_every)
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+        result = self.load(key) if self.path is not None else None
+        if result is None:
+            self.misses += 1
+            result = integrate_SEIR(*key)
+            if self.path is not None:
+                self.store(key, result)
+        else:
+            self.hits += 1
+        for array in result:
+            array.flags.writeable = False
+        self.results[key] = result
+        #evicts the least recently used result
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+        return result
+
+    def load(self, key):
+        #result of a key from the on-disk store, None if it is not there or cannot be read
+        try:
+            with np.load(self.file(key)) as data:
+                #a hash collision would load another scenario, so the stored key is checked too
+                if tuple(data['key']) == key:
+                    return data['t'], data['Y']
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            #missing, or left half written by a run that was killed, so it is recomputed and replaced
+            pass
+        return None
+
+    def store(self, key, result):
+        #writes to a temporary file in the store and renames it, so other processes never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, t=result[0], Y=result[1], key=np.array(key))
+            os.replace(tmp, self.file(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def clear(self):
+        #empties the in-memory cache, the on-disk store is kept
+        self.results.clear()
+
+#cache shared by the plotting functions
+SEIR_CACHE = SEIRCache()
+
 def plot_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf):
     """Produces a plot of the SEIR model from o to Tf
     Inputs: S0=Scalar
@@ -72,15 +162,15 @@ def plot_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf):
     Usage: plot_SEIR_model(.9,0,.1,0,1, .5, .3, 1, 100)
         Returns out: line graph with x values from 0 to 100, and y values from from S0,E0,I0,R0
     """
+    import matplotlib.pyplot as plt
+
     #creates a figure with single axes
     fig, ax = plt.subplots() 
-    #sets x values to be vector of time values
-    t=(integrate_SEIR_model(S0,E0,I0,R0,alpha,beta,gamma,dt,Tf)[4])
+    #integrates once, or reuses an earlier run of the same scenario
+    t,Y=SEIR_CACHE(S0,E0,I0,R0,alpha,beta,gamma,dt,Tf)
     #plots S,E,I, and r
-    ax.plot(t,(integrate_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf))[0], label="Susceptible")
-    ax.plot(t,(integrate_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf))[1], label="Exposed")
-    ax.plot(t,(integrate_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf))[2], label="Infected")
-    ax.plot(t,(integrate_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf))[3], label="Recovered")
+    for column,label in enumerate(("Susceptible","Exposed","Infected","Recovered")):
+        ax.plot(t,Y[:,column], label=label)
     #label axis
     ax.set_xlabel('Time')
     ax.set_ylabel('Fraction of Population')
@@ -90,14 +180,6 @@ def plot_SEIR_model(S0,E0,I0,R0,alpha, beta, gamma, dt, Tf):
     ax.legend()
     plt.show()
 
-#plots figures with various S0,E0,I0,R0,alpha, beta, gamma, step size, and end time values
-#(a) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 5, Tf = 100
-plot_SEIR_model(.9,0,.1,0,1, .5, .3, 5, 100)
-#(b) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 1, Tf = 100
-plot_SEIR_model(.9,0,.1,0,1, .5, .3, 1, 100)
-#(c) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 0.01, Tf = 100 
-plot_SEIR_model(.9,0,.1,0,1, .5, .3, .01, 100)
-
 def SEIR_mod(S, E, I , R , alpha, beta, gamma, zeta):
     """This function evaluates changes in populations of susceptible, exposed, infected, and recovered people
         Inputs: S=float
@@ -115,9 +197,8 @@ def SEIR_mod(S, E, I , R , alpha, beta, gamma, zeta):
     """
     #sets updated dSdt
     dSdt=(((-beta)*S*I)+(zeta*R)) 
-    #sets dEdt,dIdt as existing
-    dEdt=SEIR(S, E, I , R , alpha, beta, gamma)[1]
-    dIdt=SEIR(S, E, I , R , alpha, beta, gamma)[2]
+    #sets dEdt,dIdt as existing, from a single evaluation of SEIR
+    dEdt,dIdt=SEIR(S, E, I , R , alpha, beta, gamma)[1:3]
     #sets updated dRdt
     dRdt=((gamma*I)-(zeta*R))
     return dSdt, dEdt, dIdt, dRdt
@@ -174,15 +255,15 @@ def plot_SEIR_model_mod(S0, E0, I0, R0, alpha, beta, gamma, zeta, dt, Tf):
     Usage: plot_SEIR_model(.9,0,.1,0,1, .5, .3,.2, 1, 100)
         Returns out: line graph with x values from 0 to 100, and y values from from S0,E0,I0,R0
     """
+    import matplotlib.pyplot as plt
+
     #creates a figure with single axes
     fig, ax = plt.subplots() 
-    #sets x values to be vector of time values
-    t=(integrate_SEIR_model_mod(S0,E0,I0,R0,alpha,beta,gamma,zeta,dt,Tf)[4])
+    #integrates once, or reuses an earlier run of the same scenario
+    t,Y=SEIR_CACHE(S0,E0,I0,R0,alpha,beta,gamma,dt,Tf,zeta)
     #plots S,E,I, and r
-    ax.plot(t,(integrate_SEIR_model_mod(S0,E0,I0,R0,alpha, beta, gamma, zeta, dt, Tf))[0], label="Susceptible")
-    ax.plot(t,(integrate_SEIR_model_mod(S0,E0,I0,R0,alpha, beta, gamma, zeta, dt, Tf))[1], label="Exposed")
-    ax.plot(t,(integrate_SEIR_model_mod(S0,E0,I0,R0,alpha, beta, gamma, zeta, dt, Tf))[2], label="Infected")
-    ax.plot(t,(integrate_SEIR_model_mod(S0,E0,I0,R0,alpha, beta, gamma, zeta, dt, Tf))[3], label="Recovered")
+    for column,label in enumerate(("Susceptible","Exposed","Infected","Recovered")):
+        ax.plot(t,Y[:,column], label=label)
     #label axis
     ax.set_xlabel('Time')
     ax.set_ylabel('Fraction of Population')
@@ -192,8 +273,528 @@ def plot_SEIR_model_mod(S0, E0, I0, R0, alpha, beta, gamma, zeta, dt, Tf):
     ax.legend()
     plt.show()
 
-#plots figures with various S0,E0,I0,R0,alpha, beta, gamma, zeta, step size, and end time values
-#(a) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, ζ = 0.01, dt = 0.01, Tf = 100
-plot_SEIR_model_mod(.9,0,.1,0,1, .5, .3,.01, .01, 100)
-#(b) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, ζ = 0.01, dt = 0.01, Tf = 1000
-plot_SEIR_model_mod(.9,0,.1,0,1, .5, .3,.01, .01, 1000)
+def SEIR_rhs(Y, alpha, beta, gamma, zeta=0):
+    """This function evaluates the SEIR derivatives of a state, with waning immunity when zeta>0
+        Inputs: Y=sequence of S,E,I,R, either floats or equal-shaped np arrays (one entry per scenario)
+                alpha: float/np array
+                beta: float/np array
+                gamma: float/np array
+                zeta: float/np array, rate recovered people become susceptible again
+        Outputs: dSdt, dEdt, dIdt, dRdt
+        Usage: SEIR_rhs((.25,.25,.25,.25),1,.5,.3,.2)
+            Returns: (0.018750000000000003, -0.21875, 0.175, 0.024999999999999994)
+    """
+    S,E,I,R=Y
+    #new infections and lost immunity are each computed once and shared by two compartments
+    infection=beta*S*I
+    waning=zeta*R
+    dSdt=waning-infection
+    dEdt=infection-alpha*E
+    dIdt=alpha*E-gamma*I
+    dRdt=gamma*I-waning
+    return dSdt,dEdt,dIdt,dRdt
+
+def integrate_SEIR(S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta=0, record_every=1):
+    """This function integrates the SEIR model (with waning immunity when zeta>0) by forward Euler,
+    evaluating the derivative once per step and writing into preallocated arrays
+        Inputs: S0=Scalar
+                E0=Scalar
+                I0=Scalar
+                R0=Scalar
+                alpha: float/integer
+                beta: float/integer
+                gamma: float/integer
+                dt: float, step size
+                Tf: float, end time
+                zeta: float/integer
+                record_every: int, keeps every record_every-th step
+        Outputs: t, [1d np array], recorded times
+                 Y, [2d np array], one row per recorded time with columns S,E,I,R
+        Usage: integrate_SEIR(.9,0,.1,0,1, .5, .3, 5, 100)
+            Returns: (array([0., 5., 10., ...]), array([[0.9, 0., 0.1, 0.], [0.675, 0.225, -0.05, 0.15], ...]))
+    """
+    #calculates number of steps and number of recorded rows
+    n=int(Tf/dt)
+    n_out=n//record_every+1
+    t=np.arange(n_out)*(dt*record_every)
+    #rows S,E,I,R one after the other in one flat array, reshaped into n_out x 4 at the end
+    Y=np.empty(4*n_out)
+    Y[:4]=S0,E0,I0,R0
+    #the state is kept in local floats and the derivative of SEIR_rhs is written out inline, a function
+    #call or a small np array per step costs more than the arithmetic (benchmark_integrate_SEIR checks both agree)
+    S=float(S0);E=float(E0);I=float(I0);R=float(R0)
+    #record_every steps per recorded row, steps after the last recorded row would not be seen
+    steps=range(record_every)
+    for j in range(4,4*n_out,4):
+        for i in steps:
+            infection=beta*S*I;waning=zeta*R;incubated=alpha*E;recovered=gamma*I
+            S+=dt*(waning-infection);E+=dt*(infection-incubated)
+            I+=dt*(incubated-recovered);R+=dt*(recovered-waning)
+        Y[j]=S;Y[j+1]=E;Y[j+2]=I;Y[j+3]=R
+    return t,Y.reshape(n_out,4)
+
+def benchmark_integrate_SEIR(dt=.01, Tf=1000, record_every=(1,100), repeats=5):
+    """Times integrate_SEIR against integrate_SEIR_model and integrate_SEIR_model_mod
+    Inputs: dt: float, step size
+            Tf: float, end time
+            record_every: sequence of ints, output strides to time integrate_SEIR with
+            repeats: int, best of this many runs is reported
+    Outputs: printed table of run times and the largest difference from the list-based integrators,
+             and the largest difference between the inline derivative of integrate_SEIR and SEIR_rhs
+    Usage: benchmark_integrate_SEIR()
+        Returns: None
+    """
+    def best(run):
+        #best time of repeats runs, and the result of the last one
+        elapsed=np.inf
+        for r in range(repeats):
+            start=time.perf_counter()
+            result=run()
+            elapsed=min(elapsed,time.perf_counter()-start)
+        return elapsed,result
+
+    args=(.9,0,.1,0,1,.5,.3)
+    for name,zeta in (("SEIR",0),("SEIR_mod",.01)):
+        if zeta:
+            t_list,(S,E,I,R,t)=best(lambda: integrate_SEIR_model_mod(*args,zeta,dt,Tf))
+        else:
+            t_list,(S,E,I,R,t)=best(lambda: integrate_SEIR_model(*args,dt,Tf))
+        print(f"{name}: lists {t_list:.3f} s")
+        for k in record_every:
+            t_arr,(t,Y)=best(lambda: integrate_SEIR(*args,dt,Tf,zeta=zeta,record_every=k))
+            error=np.abs(Y-np.column_stack((S,E,I,R))[::k]).max()
+            print(f"{name}: arrays, every {k} {t_arr:.3f} s ({t_list/t_arr:.1f}x), max difference {error:.1e}")
+        #the steps of integrate_SEIR, divided by dt, are the derivative SEIR_rhs gives at the start of each step
+        Y=integrate_SEIR(*args,dt,min(Tf,10),zeta=zeta)[1]
+        error=np.abs(np.diff(Y,axis=0)/dt-np.array(SEIR_rhs(Y[:-1].T,*args[4:],zeta)).T).max()
+        print(f"{name}: inline derivative vs SEIR_rhs, max difference {error:.1e}")
+
+def _sweep_SEIR_chunk(args):
+    #integrates one block of scenarios, in a worker process when sweep_SEIR uses a pool
+    Y0, params, dt, n, record_every = args
+    alpha, beta, gamma, zeta = params
+    #one column per scenario, rows S,E,I,R
+    Y = Y0.copy()
+    dY = np.empty_like(Y)
+    peak_infected = Y[2].copy()
+    peak_step = np.zeros(Y.shape[1], dtype=int)
+    curves = None
+    if record_every:
+        curves = np.empty((n//record_every+1,) + Y.shape)
+        curves[0] = Y
+    for i in range(1, n+1):
+        dY[:] = SEIR_rhs(Y, alpha, beta, gamma, zeta)
+        dY *= dt
+        Y += dY
+        #remembers the step where each scenario's infected fraction is largest
+        I = Y[2]
+        np.copyto(peak_step, i, where=I > peak_infected)
+        np.maximum(peak_infected, I, out=peak_infected)
+        if record_every and i%record_every == 0:
+            curves[i//record_every] = Y
+    return peak_infected, peak_step*dt, Y[3].copy(), curves
+
+def sweep_SEIR(S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, zeta=0, record_every=None, processes=1, chunk_size=4096):
+    """This function integrates many SEIR scenarios at once by forward Euler, with every scenario a column of one
+    state matrix so each step is a few array operations instead of a Python loop per scenario
+        Inputs: S0,E0,I0,R0: floats/np arrays, initial fractions of each scenario
+                alpha, beta, gamma, zeta: floats/np arrays, rates of each scenario
+                Note: all of the above are broadcast against each other, e.g. outputs of np.meshgrid
+                dt: float, step size
+                Tf: float, end time
+                record_every: int or None, also returns every record_every-th step of the full curves
+                processes: int, worker processes, 1 integrates in this process
+                chunk_size: int, scenarios per block handed to a worker
+        Outputs: dict with peak_infected, peak_time and final_recovered (np arrays in the broadcast shape) and,
+                 with record_every, t and Y (len(t) x 4 x broadcast shape, rows S,E,I,R)
+        Usage: sweep_SEIR(.9,0,.1,0,1,np.linspace(.3,.8,6),.3,.01,100)
+            Returns: {'peak_infected': array([0.1, 0.1, 0.1201..., ...]), 'peak_time': array([0., 0., 8.62, ...]), ...}
+    """
+    #broadcasts inputs and flattens them to one column per scenario
+    values = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (S0, E0, I0, R0, alpha, beta, gamma, zeta)])
+    shape = values[0].shape
+    values = np.array([v.ravel() for v in values])
+    Y0, params = values[:4], values[4:]
+    n = int(Tf/dt)
+    m = Y0.shape[1]
+    blocks = [(Y0[:, k:k+chunk_size], params[:, k:k+chunk_size], dt, n, record_every)
+              for k in range(0, m, chunk_size)]
+
+    #runs the blocks here or on a process pool, each scenario's result does not depend on the blocking
+    if processes == 1:
+        results = [_sweep_SEIR_chunk(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_sweep_SEIR_chunk, blocks))
+
+    #joins the blocks back together in scenario order
+    peak_infected, peak_time, final_recovered, curves = zip(*results)
+    sweep = {'peak_infected': np.concatenate(peak_infected).reshape(shape),
+             'peak_time': np.concatenate(peak_time).reshape(shape),
+             'final_recovered': np.concatenate(final_recovered).reshape(shape)}
+    if record_every:
+        Y = np.concatenate(curves, axis=2)
+        sweep['t'] = np.arange(len(Y))*(dt*record_every)
+        sweep['Y'] = Y.reshape(Y.shape[:2] + shape)
+    return sweep
+
+#Dormand-Prince 5(4) tableau, weights of the 5th order solution, error weights (5th minus 4th order,
+#including the FSAL stage) and the coefficients of its 4th order dense output polynomial in theta
+DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+DP_A = [np.array([]),
+        np.array([1/5]),
+        np.array([3/40, 9/40]),
+        np.array([44/45, -56/15, 32/9]),
+        np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+        np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656])]
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+DP_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+DP_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
+def _hermite(y0, y1, f0, f1, h, theta):
+    #cubic Hermite interpolant between two steps, theta=(t-t0)/h
+    theta = theta.reshape((-1,) + (1,)*y0.ndim)
+    return ((1 - theta)*y0 + theta*y1
+            + theta*(theta - 1)*((1 - 2*theta)*(y1 - y0) + (theta - 1)*h*f0 + theta*h*f1))
+
+def solve_SEIR(S0, E0, I0, R0, alpha, beta, gamma, t_eval, zeta=0, method='RK45', dt=None, rtol=1e-6, atol=1e-9, full_output=False):
+    """This function integrates the SEIR model (with waning immunity when zeta>0) with a higher order method
+    and returns the populations at the requested times by dense interpolation, so the step size does not
+    have to match the output times
+        Inputs: S0,E0,I0,R0: floats/np arrays, initial fractions (arrays integrate several scenarios at once)
+                alpha, beta, gamma, zeta: floats/np arrays, rates
+                t_eval: 1d np array, increasing output times, from 0 on
+                method: str, 'RK4' (fixed step dt, cubic Hermite output) or 'RK45' (Dormand-Prince with
+                        adaptive steps and its 4th order dense output)
+                dt: float, step size of RK4 (default 1), largest step of RK45 (default unlimited)
+                rtol, atol: floats, relative and absolute error allowed per RK45 step
+                full_output: bool, also returns a dict of step statistics
+        Outputs: t_eval, [1d np array]
+                 Y, [np array], len(t_eval) x 4 (x scenario shape), columns S,E,I,R
+                 with full_output, dict with n_evals (derivative evaluations), n_steps and n_rejected
+        Usage: solve_SEIR(.9,0,.1,0,1, .5, .3, np.linspace(0,100,101))
+            Returns: (array([0., 1., ...]), array([[0.9, 0., 0.1, 0.], [0.8597..., 0.0250..., 0.0877..., 0.0274...], ...]))
+    """
+    t_eval = np.asarray(t_eval, dtype=float)
+    #the state has one column per scenario when any input is an array
+    values = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (S0, E0, I0, R0, alpha, beta, gamma, zeta)])
+    y = np.array(values[:4])
+    Y = np.empty((len(t_eval),) + y.shape)
+    stats = {'n_evals': 1, 'n_steps': 0, 'n_rejected': 0}
+
+    def rhs(y):
+        return np.array(SEIR_rhs(y, alpha, beta, gamma, zeta))
+
+    #outputs at the initial time, k is the next output still to fill
+    k = np.searchsorted(t_eval, 0, 'right')
+    Y[:k] = y
+    t = 0.0
+    Tf = t_eval[-1] if len(t_eval) else 0.0
+    f = rhs(y)
+
+    if method == 'RK4':
+        dt = 1 if dt is None else dt
+        #equal steps that land on Tf
+        n = int(np.ceil(Tf/dt - 1e-12)) if Tf > 0 else 0
+        h = Tf/n if n else 0.0
+        for i in range(1, n+1):
+            k2 = rhs(y + h/2*f)
+            k3 = rhs(y + h/2*k2)
+            k4 = rhs(y + h*k3)
+            y_new = y + h/6*(f + 2*k2 + 2*k3 + k4)
+            f_new = rhs(y_new)
+            t_new = Tf if i == n else i*h
+            #fills every output inside this step
+            k_new = np.searchsorted(t_eval, t_new, 'right')
+            Y[k:k_new] = _hermite(y, y_new, f, f_new, h, (t_eval[k:k_new] - t)/h)
+            y, f, t, k = y_new, f_new, t_new, k_new
+        stats['n_evals'] += 4*n
+        stats['n_steps'] = n
+
+    elif method == 'RK45':
+        #initial step from the size of the state and its derivative
+        scale = atol + np.abs(y)*rtol
+        #rms over S,E,I,R of each scenario, the step suits the fastest scenario
+        d0 = np.sqrt(np.mean((y/scale)**2, axis=0))
+        d1 = np.sqrt(np.mean((f/scale)**2, axis=0))
+        h = np.min(np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01*d0/np.maximum(d1, 1e-300)))
+        dt = np.inf if dt is None else dt
+        K = np.empty((7,) + y.shape)
+        while t < Tf:
+            h = min(h, dt, Tf - t)
+            K[0] = f
+            for s in range(1, 6):
+                K[s] = rhs(y + h*np.tensordot(DP_A[s], K[:s], 1))
+            y_new = y + h*np.tensordot(DP_B, K[:6], 1)
+            #the last stage is the derivative at the new point and starts the next step (FSAL)
+            K[6] = rhs(y_new)
+            stats['n_evals'] += 6
+            #rms of the error estimate relative to the allowed error in each scenario, the worst one decides
+            scale = atol + np.maximum(np.abs(y), np.abs(y_new))*rtol
+            error = np.sqrt(np.mean((h*np.tensordot(DP_E, K, 1)/scale)**2, axis=0)).max()
+            if error > 1:
+                h *= max(0.2, 0.9*error**-0.2)
+                stats['n_rejected'] += 1
+                continue
+            t_new = Tf if Tf - t - h < 1e-12*Tf else t + h
+            k_new = np.searchsorted(t_eval, t_new, 'right')
+            if k_new > k:
+                #y(t + theta*h) = y + h*sum_s K[s]*(P[s] @ [theta, theta^2, theta^3, theta^4])
+                theta = (t_eval[k:k_new] - t)/h
+                Q = np.tensordot(DP_P, K, (0, 0))
+                powers = theta[:, None]**np.arange(1, 5)
+                Y[k:k_new] = y + h*np.tensordot(powers, Q, 1)
+            y, f, t, k = y_new, K[6].copy(), t_new, k_new
+            stats['n_steps'] += 1
+            h *= min(10, 0.9*error**-0.2) if error > 0 else 10
+    else:
+        raise ValueError(f"unknown method {method!r}, use 'RK4' or 'RK45'")
+
+    if full_output:
+        return t_eval, Y, stats
+    return t_eval, Y
+
+def benchmark_solve_SEIR(Tf=1000, zeta=.01, n_out=1001):
+    """Compares the error and the number of derivative evaluations of forward Euler, RK4 and RK45 on the
+    SEIR model with waning immunity, against a tightly converged RK45 solution
+    Inputs: Tf: float, end time
+            zeta: float
+            n_out: int, number of equally spaced output times the error is measured at
+    Outputs: printed table of method, derivative evaluations, run time and largest error
+    Usage: benchmark_solve_SEIR()
+        Returns: None
+    """
+    args = (.9, 0, .1, 0, 1, .5, .3)
+    t_out = np.linspace(0, Tf, n_out)
+    Y_ref = solve_SEIR(*args, t_out, zeta=zeta, rtol=1e-12, atol=1e-14)[1]
+    for dt in (.1, .01):
+        start = time.perf_counter()
+        Y = integrate_SEIR(*args, dt, Tf, zeta=zeta, record_every=int(round(t_out[1]/dt)))[1]
+        elapsed = time.perf_counter() - start
+        print(f"Euler dt={dt:<7g} {int(Tf/dt):8d} evaluations {elapsed:8.3f} s  max error {np.abs(Y - Y_ref).max():.1e}")
+    for method, options in (('RK4', {'dt': 1}), ('RK4', {'dt': .5}),
+                            ('RK45', {'rtol': 1e-4, 'atol': 1e-7}), ('RK45', {'rtol': 1e-6, 'atol': 1e-9}),
+                            ('RK45', {'rtol': 1e-8, 'atol': 1e-11})):
+        start = time.perf_counter()
+        Y, stats = solve_SEIR(*args, t_out, zeta=zeta, method=method, full_output=True, **options)[1:]
+        elapsed = time.perf_counter() - start
+        name = f"{method} {list(options)[0]}={list(options.values())[0]:g}"
+        print(f"{name:16s} {stats['n_evals']:8d} evaluations {elapsed:8.3f} s  max error {np.abs(Y - Y_ref).max():.1e}")
+
+def random_mobility(n_regions, n_links=10, stay=.9, seed=0):
+    """This function builds a random sparse mobility matrix for testing the networked SEIR model
+        Inputs: n_regions: int
+                n_links: int, regions each region mixes with besides itself
+                stay: float, fraction of contacts a region makes at home
+                seed: int
+        Outputs: scipy.sparse csr matrix, n_regions x n_regions, rows sum to 1
+        Usage: random_mobility(4, 2, .5)
+            Returns: <4x4 sparse matrix of dtype 'float64' ...>
+    """
+    import scipy.sparse
+
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n_regions), n_links)
+    #other regions visited, with random shares of the contacts made away from home
+    cols = (rows + rng.integers(1, n_regions, len(rows))) % n_regions
+    weights = rng.random(len(rows)).reshape(n_regions, n_links)
+    weights *= (1 - stay)/weights.sum(axis=1, keepdims=True)
+    away = scipy.sparse.csr_matrix((weights.ravel(), (rows, cols)), shape=(n_regions, n_regions))
+    return (away + stay*scipy.sparse.identity(n_regions, format='csr')).tocsr()
+
+def integrate_SEIR_network(S0, E0, I0, R0, mobility, alpha, beta, gamma, dt, Tf, zeta=0, record_every=1):
+    """This function integrates a metapopulation SEIR model with waning immunity by forward Euler. Each region has
+    its own S,E,I,R fractions and people in region i meet the infected of region j in proportion to mobility[i,j],
+    so the force of infection is beta times one sparse matrix-vector product per step and the cost grows with the
+    number of connections rather than the square of the number of regions. With the identity as mobility every
+    region follows SEIR_mod on its own.
+        Inputs: S0,E0,I0,R0: np arrays/floats, initial fractions of each region
+                mobility: n_regions x n_regions matrix (scipy.sparse or dense), contact share of region i with
+                          region j, rows normally sum to 1
+                alpha, beta, gamma, zeta: floats/np arrays, rates (arrays give one per region)
+                dt: float, step size
+                Tf: float, end time
+                record_every: int, keeps every record_every-th step
+        Outputs: t, [1d np array], recorded times
+                 Y, [3d np array], len(t) x 4 x n_regions, rows S,E,I,R
+        Usage: integrate_SEIR_network(.9, 0, [.1, 0], 0, [[.9, .1], [.1, .9]], 1, .5, .3, .01, 100)
+            Returns: (array([0., 0.01, ...]), array([[[0.9, 0.9], [0., 0.], [0.1, 0.], [0., 0.]], ...]))
+    """
+    import scipy.sparse
+
+    mobility = scipy.sparse.csr_matrix(mobility)
+    values = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (S0, E0, I0, R0)] + [np.zeros(mobility.shape[0])])
+    #rows S,E,I,R, one column per region
+    Y0 = np.array(values[:4])
+    n = int(Tf/dt)
+    Y = np.empty((n//record_every+1,) + Y0.shape)
+    Y[0] = Y0
+    S, E, I, R = Y0
+    for i in range(1, n+1):
+        #force of infection felt in every region from the infected of the regions it mixes with
+        infection = beta*(mobility @ I)*S
+        waning = zeta*R
+        incubated = alpha*E
+        recovered = gamma*I
+        S = S + dt*(waning - infection)
+        E = E + dt*(infection - incubated)
+        I = I + dt*(incubated - recovered)
+        R = R + dt*(recovered - waning)
+        if i%record_every == 0:
+            Y[i//record_every] = S, E, I, R
+    return np.arange(len(Y))*(dt*record_every), Y
+
+def benchmark_SEIR_network(n_regions=10000, n_links=10, dt=.01, Tf=10, n_dense=2000):
+    """Times integrate_SEIR_network on a random sparse mobility network, next to the cost a dense
+    mobility matrix would have
+    Inputs: n_regions: int
+            n_links: int, connections per region
+            dt: float, step size
+            Tf: float, end time
+            n_dense: int, size of the dense matrix-vector product that is timed and scaled up to n_regions
+    Outputs: printed time per step of the sparse model and of a dense product
+    Usage: benchmark_SEIR_network()
+        Returns: None
+    """
+    mobility = random_mobility(n_regions, n_links)
+    rng = np.random.default_rng(1)
+    I0 = np.where(rng.random(n_regions) < .01, .01, 0)
+    n = int(Tf/dt)
+    start = time.perf_counter()
+    integrate_SEIR_network(1 - I0, 0, I0, 0, mobility, 1, .5, .3, dt, Tf, zeta=.01, record_every=n)
+    sparse_step = (time.perf_counter() - start)/n
+    print(f"{n_regions} regions, {mobility.nnz} connections: {n} steps in {sparse_step*n:.2f} s, {sparse_step*1e6:.0f} us per step")
+    #a dense product grows with regions squared, so a smaller one is timed and scaled
+    dense = random_mobility(n_dense, n_links).toarray()
+    start = time.perf_counter()
+    for i in range(100):
+        dense @ I0[:n_dense]
+    dense_product = (time.perf_counter() - start)/100*(n_regions/n_dense)**2
+    print(f"dense mobility matrix: about {dense_product*1e6:.0f} us per step for the product alone ({dense_product/sparse_step:.0f}x)")
+
+def _SEIR_binomial_chunk(args):
+    #runs one block of stochastic runs, in a worker process when SEIR_binomial_ensemble uses a pool
+    Y0, alpha, beta, gamma, zeta, dt, n, record_every, n_runs, width, n_bins, seed = args
+    rng = np.random.default_rng(seed)
+    #rows S,E,I,R, one column per run
+    Y = np.repeat(np.asarray(Y0, dtype=np.int64)[:, None], n_runs, axis=1)
+    N = Y[:, 0].sum()
+    #chance of leaving E, I and R within one step
+    p_incubate = -np.expm1(-alpha*dt)
+    p_recover = -np.expm1(-gamma*dt)
+    p_wane = -np.expm1(-zeta*dt)
+    hist = np.zeros((n//record_every+1, 4, n_bins), dtype=np.int64)
+    total = np.zeros((n//record_every+1, 4), dtype=np.int64)
+    #offsets that give each compartment its own range of bins in one bincount
+    offset = np.arange(4)[:, None]*n_bins
+    def record(k):
+        hist[k] = np.bincount((Y//width + offset).ravel(), minlength=4*n_bins).reshape(4, n_bins)
+        total[k] = Y.sum(axis=1)
+    record(0)
+    for i in range(1, n+1):
+        S, E, I, R = Y
+        #numbers of people moving along S->E->I->R->S in this step
+        infected = rng.binomial(S, -np.expm1(-beta*I/N*dt))
+        incubated = rng.binomial(E, p_incubate)
+        recovered = rng.binomial(I, p_recover)
+        waned = rng.binomial(R, p_wane)
+        S += waned - infected
+        E += infected - incubated
+        I += incubated - recovered
+        R += recovered - waned
+        if i%record_every == 0:
+            record(i//record_every)
+    return hist, total
+
+def SEIR_binomial_ensemble(S0, E0, I0, R0, alpha, beta, gamma, dt, Tf, n_runs, zeta=0, record_every=1,
+                           quantiles=(.05, .25, .5, .75, .95), seed=0, processes=1, chunk_size=1000, max_bins=1000):
+    """This function runs an ensemble of stochastic SEIR models (with waning immunity when zeta>0) on whole numbers
+    of people. In every step of dt the numbers leaving each compartment are binomial draws, with the chance
+    1-exp(-rate*dt) of leaving S (rate beta*I/N), E (alpha), I (gamma) and R (zeta). All runs of a block are advanced
+    together as a 4 x runs array. Instead of the trajectories, each recorded time keeps a histogram of every
+    compartment over the runs, so memory does not depend on n_runs and the blocks merge by adding histograms.
+        Inputs: S0,E0,I0,R0: ints, initial numbers of people
+                alpha, beta, gamma, zeta: floats, rates
+                dt: float, step size
+                Tf: float, end time
+                n_runs: int, number of runs
+                record_every: int, keeps every record_every-th step
+                quantiles: sequence of floats, levels of the returned bands
+                seed: int, root seed, every block gets its own stream spawned from it
+                processes: int, worker processes, 1 runs in this process
+                chunk_size: int, runs per block, the results do not depend on processes but do on chunk_size
+                max_bins: int, largest number of histogram bins, counts are exact when the population is below it
+                          and are otherwise resolved to population/max_bins people
+        Outputs: dict with t (recorded times), quantiles, bands (len(quantiles) x len(t) x 4, numbers of people)
+                 and mean (len(t) x 4)
+        Usage: SEIR_binomial_ensemble(90,0,10,0,1,.5,.3,.1,100,1000)
+            Returns: {'t': array([0., 0.1, ...]), 'quantiles': array([0.05, ...]), 'bands': array([[[90., 0., 10., 0.], ...]]), 'mean': ...}
+    """
+    Y0 = np.array([S0, E0, I0, R0], dtype=np.int64)
+    n = int(Tf/dt)
+    #bins of width people, so there are at most max_bins of them
+    width = -(-(int(Y0.sum()) + 1)//max_bins)
+    n_bins = int(Y0.sum())//width + 1
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_runs//chunk_size))
+    blocks = [(Y0, alpha, beta, gamma, zeta, dt, n, record_every, min(chunk_size, n_runs - k), width, n_bins, seeds[b])
+              for b, k in enumerate(range(0, n_runs, chunk_size))]
+
+    #histograms and totals of the blocks simply add up, each block is added as soon as it is done
+    #and then dropped, so memory does not grow with the number of blocks
+    hist = np.zeros((n//record_every+1, 4, n_bins), dtype=np.int64)
+    total = np.zeros((n//record_every+1, 4), dtype=np.int64)
+    def add(result):
+        hist[...] += result[0]
+        total[...] += result[1]
+
+    #runs the blocks here or on a process pool
+    if processes == 1:
+        for block in blocks:
+            add(_SEIR_binomial_chunk(block))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            #blocks handed to the pool, at most two per process are waiting at a time
+            pending = deque()
+            for block in blocks:
+                pending.append(pool.submit(_SEIR_binomial_chunk, block))
+                if len(pending) >= 2*processes:
+                    add(pending.popleft().result())
+            while pending:
+                add(pending.popleft().result())
+
+    #each band is the first bin where the cumulative count reaches its share of the runs, at the bin centre
+    cdf = np.cumsum(hist, axis=-1)
+    quantiles = np.asarray(quantiles, dtype=float)
+    bands = np.array([(cdf >= q*n_runs).argmax(axis=-1) for q in quantiles])*width + (width - 1)/2
+    return {'t': np.arange(len(hist))*(dt*record_every), 'quantiles': quantiles, 'bands': bands, 'mean': total/n_runs}
+
+def main():
+    """Plots the SEIR model and the SEIR model with waning immunity for the assignment cases
+    Inputs: None
+    Outputs: line graphs
+    Usage: main()
+        Returns: None
+    """
+    #plots figures with various S0,E0,I0,R0,alpha, beta, gamma, step size, and end time values
+    #(a) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 5, Tf = 100
+    plot_SEIR_model(.9,0,.1,0,1, .5, .3, 5, 100)
+    #(b) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 1, Tf = 100
+    plot_SEIR_model(.9,0,.1,0,1, .5, .3, 1, 100)
+    #(c) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, dt = 0.01, Tf = 100 
+    plot_SEIR_model(.9,0,.1,0,1, .5, .3, .01, 100)
+
+    #plots figures with various S0,E0,I0,R0,alpha, beta, gamma, zeta, step size, and end time values
+    #(a) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, ζ = 0.01, dt = 0.01, Tf = 100
+    plot_SEIR_model_mod(.9,0,.1,0,1, .5, .3,.01, .01, 100)
+    #(b) S0 = 0.9, E0 = R0 = 0, I0 = 0.1, α = 1, β = 0.5, γ = 0.3, ζ = 0.01, dt = 0.01, Tf = 1000
+    plot_SEIR_model_mod(.9,0,.1,0,1, .5, .3,.01, .01, 1000)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,241 @@
 #import modules
-import cv2 as cv
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+#cv2 and matplotlib are imported by the functions that use them, so importing this module stays cheap
 
 def isOpen(f):
+    import matplotlib.pyplot as plt
     return plt.fignum_exists(f.number)
 
-def calc_center_pixels(v1,v2,height,width):
-    """Calculates the center of the ball in pixels
+#HSV range of the ball, hue 1-29, saturation above 160 and value above 110
+BALL_HSV_LOW = (1, 161, 111)
+BALL_HSV_HIGH = (29, 255, 255)
+
+def ball_mask(img):
+    """Finds the pixels of the ball in one frame
+        Inputs: img = BGR image, np array (height x width x 3)
+        Outputs: mask = np array (height x width), 255 on the ball and 0 elsewhere
+        Usage: ball_mask(img)
+            Returns: array([[0, 0, ...], ...], dtype=uint8)
+    """
+    import cv2 as cv
+
+    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
+    return cv.inRange(img_hsv, BALL_HSV_LOW, BALL_HSV_HIGH)
+
+def ball_center(mask):
+    """Calculates the center of the ball from its mask
+        Inputs: mask = np array (height x width), nonzero on the ball
+        Outputs: x, y = floats, mean column and row of the ball pixels, nan when there are none
+        Usage: ball_center(ball_mask(img))
+            Returns: 128.6341, 178.3053
+    """
+    import cv2 as cv
+
+    moments = cv.moments(mask, binaryImage=True)
+    if moments['m00'] == 0:
+        return np.nan, np.nan
+    return moments['m10']/moments['m00'], moments['m01']/moments['m00']
+
+def open_video(video):
+    """Opens a video file, or passes an already opened capture through
+        Inputs: video = file path or cv2.VideoCapture
+        Outputs: cv2.VideoCapture
+        Usage: open_video('right.mp4')
+            Returns: <cv2.VideoCapture ...>
+    """
+    import cv2 as cv
+
+    if isinstance(video, str):
+        return cv.VideoCapture(video)
+    return video
+
+def track_ball(video1, video2, preview=None, preview_every=10, max_frames=None):
+    """Calculates the center of the ball in pixels in every frame of two videos, without any figure
+        Inputs: video1 = right video, file path or cv2.VideoCapture
+                video2 = left video, file path or cv2.VideoCapture
+                preview = function or None, called as preview(frame, img1, img2, mask1, mask2, centers) on every
+                          preview_every-th frame with centers = (x1, y1, x2, y2), tracking stops if it returns False
+                preview_every = integer
+                max_frames = integer or None, stops after this many frame pairs
+        Outputs: center_x1 = 1d np array
+                 center_y1 = 1d np array
+                 center_x2 = 1d np array
+                 center_y2 = 1d np array
+        Usage: track_ball('right.mp4', 'left.mp4')
+            Returns: array([128.6341, ...]), array([178.3053, ...]), array([...]), array([...])
+    """
+    v1 = open_video(video1)
+    v2 = open_video(video2)
+    centers = []
+    try:
+        while v1.isOpened() and v2.isOpened() and (max_frames is None or len(centers) < max_frames):
+            has_frame1, img1 = v1.read()
+            has_frame2, img2 = v2.read()
+            if not (has_frame1 and has_frame2):
+                break
+            mask1 = ball_mask(img1)
+            mask2 = ball_mask(img2)
+            centers.append(ball_center(mask1) + ball_center(mask2))
+            frame = len(centers) - 1
+            if preview is not None and frame % preview_every == 0:
+                if preview(frame, img1, img2, mask1, mask2, centers[-1]) is False:
+                    break
+    finally:
+        #captures opened here are closed here, ones passed in belong to the caller
+        if v1 is not video1:
+            v1.release()
+        if v2 is not video2:
+            v2.release()
+    centers = np.array(centers, dtype=float).reshape(-1, 4)
+    return centers[:,0], centers[:,1], centers[:,2], centers[:,3]
+
+def _put_frame(frames, item, stop):
+    #waits for room in a bounded queue, giving up once tracking has stopped
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=.1)
+            return
+        except queue.Full:
+            pass
+
+def _decode_frames(video, frames, stop):
+    #reads the frames of one video in order into a bounded queue, None marks the end
+    try:
+        while video.isOpened() and not stop.is_set():
+            has_frame, img = video.read()
+            if not has_frame:
+                break
+            _put_frame(frames, img, stop)
+    finally:
+        _put_frame(frames, None, stop)
+
+def _track_frame_pair(img1, img2):
+    #ball centers of one right and left frame, run on a worker thread
+    return ball_center(ball_mask(img1)) + ball_center(ball_mask(img2))
+
+def track_ball_pipelined(video1, video2, workers=None, queue_size=16, max_frames=None):
+    """Calculates the center of the ball in pixels in every frame of two videos, like track_ball, with decoding and
+    image processing overlapped: each video is decoded on its own thread into a bounded queue, frame pairs are
+    masked and centered on a pool of worker threads (cv2 releases the GIL) and the results are put back in frame order
+        Inputs: video1 = right video, file path or cv2.VideoCapture
+                video2 = left video, file path or cv2.VideoCapture
+                workers = integer or None, worker threads, None uses one per core
+                queue_size = integer, decoded frames each video may run ahead of the workers
+                max_frames = integer or None, stops after this many frame pairs
+        Outputs: center_x1 = 1d np array
+                 center_y1 = 1d np array
+                 center_x2 = 1d np array
+                 center_y2 = 1d np array
+        Usage: track_ball_pipelined('right.mp4', 'left.mp4')
+            Returns: array([128.6341, ...]), array([178.3053, ...]), array([...]), array([...])
+    """
+    v1 = open_video(video1)
+    v2 = open_video(video2)
+    workers = workers or os.cpu_count() or 1
+    stop = threading.Event()
+    frames1 = queue.Queue(queue_size)
+    frames2 = queue.Queue(queue_size)
+    decoders = [threading.Thread(target=_decode_frames, args=(v1, frames1, stop), daemon=True),
+                threading.Thread(target=_decode_frames, args=(v2, frames2, stop), daemon=True)]
+    for decoder in decoders:
+        decoder.start()
+    centers = []
+    #frame pairs handed to the workers, oldest first, so results leave in frame order
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            while max_frames is None or len(centers) + len(pending) < max_frames:
+                #both queues are in decoding order, so the n-th frame of each forms the n-th pair
+                img1 = frames1.get()
+                img2 = frames2.get()
+                if img1 is None or img2 is None:
+                    break
+                pending.append(pool.submit(_track_frame_pair, img1, img2))
+                #bounds the pairs in flight, waiting for the oldest one
+                if len(pending) >= 2*workers:
+                    centers.append(pending.popleft().result())
+            while pending:
+                centers.append(pending.popleft().result())
+    finally:
+        #stops the decoders before the captures they read from are released
+        stop.set()
+        for decoder in decoders:
+            decoder.join()
+        if v1 is not video1:
+            v1.release()
+        if v2 is not video2:
+            v2.release()
+    centers = np.array(centers, dtype=float).reshape(-1, 4)
+    return centers[:,0], centers[:,1], centers[:,2], centers[:,3]
+
+class TrackingPreview(object):
+    """
+    Matplotlib preview for track_ball, showing both camera images, their ball masks and the ball centers
+    Inputs: height, width = integers, frame size
+    Usage: track_ball(v1, v2, preview=TrackingPreview(height, width), preview_every=10)
+    """
+    def __init__(self, height, width):
+        import matplotlib.pyplot as plt
+
+        # set up plotting
+        plt.ion()
+        self.fig, ax = plt.subplots(2,2)
+
+        #sets up left video and mask/center
+        self.h_img_left = ax[0,0].imshow(np.zeros((height,width,3)))
+        self.h_ball_left = ax[1,0].imshow(np.ones((height,width)), cmap='viridis', vmin=0, vmax=1)
+        self.h_center_left = ax[1,0].plot(0,0,'*r')[0]
+        ax[0,0].set_title("Left Camera")
+        ax[1,0].set_title("Left Mask")
+
+        #sets up right video and mask/center
+        self.h_img_right = ax[0,1].imshow(np.zeros((height,width,3)))
+        self.h_ball_right = ax[1,1].imshow(np.ones((height,width)), cmap='viridis', vmin=0, vmax=1)
+        self.h_center_right = ax[1,1].plot(0,0,'*r')[0]
+        ax[0,1].set_title("Right Camera")
+        ax[1,1].set_title("Right Mask")
+
+        plt.show()
+
+    def __call__(self, frame, img1, img2, mask1, mask2, centers):
+        import cv2 as cv
+
+        #stops tracking once the figure is closed
+        if not isOpen(self.fig):
+            return False
+        x_mid1, y_mid1, x_mid2, y_mid2 = centers
+
+        #display right video, mask and center
+        self.h_img_right.set_data(cv.cvtColor(img1, cv.COLOR_BGR2RGB))
+        self.h_ball_right.set_data(mask1 > 0)
+        self.h_center_right.set_data([x_mid1],[y_mid1])
+
+        #display left video, mask and center
+        self.h_img_left.set_data(cv.cvtColor(img2, cv.COLOR_BGR2RGB))
+        self.h_ball_left.set_data(mask2 > 0)
+        self.h_center_left.set_data([x_mid2],[y_mid2])
+
+        self.fig.canvas.draw()
+        self.fig.canvas.flush_events()
+        return True
+
+    def close(self):
+        import matplotlib.pyplot as plt
+
+        plt.ioff()
+
+def calc_center_pixels(v1,v2,height,width,preview_every=1):
+    """Calculates the center of the ball in pixels, showing the videos, masks and centers while it tracks
         Inputs: v1= video
                 v2= video
                 height= integer
                 width= integer
+                preview_every= integer, the figure is redrawn every preview_every-th frame
         Outputs: center_x1 = 1d np array
                 center_y1 = 1d np array
                 center_x2 = 1d np array
@@ -19,91 +243,18 @@ def calc_center_pixels(v1,v2,height,width):
         Usage: calc_center_pixels(v1,v2,height,width)
             Returns: []...[]...[], [128.6341,178.3053...]
     """
-    # set up plotting
-    plt.ion()
-    fig, ax = plt.subplots(2,2)
-
-    #sets up left video and mask/center
-    h_img_left = ax[0,0].imshow(np.zeros((height,width,3)))
-    h_ball_left = ax[1,0].imshow(np.ones((height,width)), cmap='viridis', vmin=0, vmax=1)
-    h_center_left = ax[1,0].plot(0,0,'*r')[0]
+    import cv2 as cv
 
-    #sets up right video and mask/center
-    h_img_right = ax[0,1].imshow(np.zeros((height,width,3)))
-    h_ball_right = ax[1,1].imshow(np.ones((height,width)), cmap='viridis', vmin=0, vmax=1)
-    h_center_right = ax[1,1].plot(0,0,'*r')[0]
-
-    plt.show()
+    preview = TrackingPreview(height, width)
+    try:
+        centers = track_ball(v1, v2, preview=preview, preview_every=preview_every)
+    finally:
+        v1.release()
+        v2.release()
+        cv.destroyAllWindows()
+        preview.close()
 
-    #sets empty arrays for center of the ball in pixels
-    center_x1=[]
-    center_y1=[]
-    center_x2=[]
-    center_y2=[]
-
-    # start processing video
-    while v1.isOpened() and v2.isOpened() and isOpen(fig):
-        has_frame1, img1 = v1.read()
-        has_frame2, img2 = v2.read()
-
-        if has_frame1 and has_frame2:
-            
-            #display right video
-            img_plt_right = cv.cvtColor(img1, cv.COLOR_BGR2RGB)
-            h_img_right.set_data(img_plt_right)
-            ax[0,1].set_title("Right Camera")
-            ax[1,1].set_title("Right Mask")
-
-            #display left video
-            img_plt_left = cv.cvtColor(img2, cv.COLOR_BGR2RGB)
-            h_img_left.set_data(img_plt_left)
-            ax[0,0].set_title("Left Camera")
-            ax[1,0].set_title("Left Mask")
-
-            # isplay right mask
-            img_hsv_right = cv.cvtColor(img1, cv.COLOR_BGR2HSV)
-            mask_h1 = (img_hsv_right[:,:,0] > 0) & (img_hsv_right[:,:,0] < 30)
-            mask_s1 = (img_hsv_right[:,:,1] > 160)
-            mask_v1 = (img_hsv_right[:,:,2] > 110)
-            mask1 = mask_h1 & mask_s1 & mask_v1
-            h_ball_right.set_data(1*mask1)
-
-            #display left mask
-            img_hsv_left = cv.cvtColor(img2, cv.COLOR_BGR2HSV)
-            mask_h2 = (img_hsv_left[:,:,0] > 0) & (img_hsv_left[:,:,0] < 30)
-            mask_s2 = (img_hsv_left[:,:,1] > 160)
-            mask_v2 = (img_hsv_left[:,:,2] > 110)
-            mask2 = mask_h2 & mask_s2 & mask_v2
-            h_ball_left.set_data(1*mask2)
-
-            #calculate right ball center
-            row1,col1 = np.where(mask1)
-            x_mid1 = np.mean(col1)
-            y_mid1 = np.mean(row1)
-            h_center_right.set_data(x_mid1,y_mid1)
-            center_x1.append(x_mid1)
-            center_y1.append(y_mid1)
-
-            #calculate left ball center
-            row2,col2 = np.where(mask2)
-            x_mid2 = np.mean(col2)
-            y_mid2 = np.mean(row2)
-            h_center_left.set_data(x_mid2,y_mid2)
-            center_x2.append(x_mid2)
-            center_y2.append(y_mid2)
-            
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-            
-        else:
-            break
-            
-    v1.release()
-    v2.release()
-    cv.destroyAllWindows()
-    plt.ioff()
-
-    return center_x1,center_y1,center_x2,center_y2
+    return centers
 
 def calc_center_inches(scale,centerx,centery,width,height):
     """Calculates the center of the ball in inches
@@ -139,6 +290,8 @@ def plot_ball_center(center_leftx1,center_lefty1,center_rightx2, center_righty2)
     Usage: plot_ball_center(center_leftx1,center_lefty1,center_rightx2, center_righty2)
         Return: plot
     """
+    import matplotlib.pyplot as plt
+
     #sets up plots
     fix,ax=plt.subplots(1,2)
 
@@ -191,6 +344,8 @@ def plot_3dtrajectory(pos_x,pos_y,pos_z):
         Usage: plot_3dtrajectory(pos_x,pos_y,pos_z)
             Returns: 3d plot
     """
+    import matplotlib.pyplot as plt
+
     #plots 3d trajectory
     fig=plt.figure()
     ax = plt.figure().add_subplot(111,projection='3d')
@@ -212,6 +367,8 @@ def plot_2dtrajectory(pos_x,pos_y, pos_z,time):
         Usage: plot_2dtrajectory(pos_x, pos_y, pos_z)
             Returns: 2d plot
     """
+    import matplotlib.pyplot as plt
+
     #plots 2d trajectory
     fig,ax=plt.subplots()
     ax.plot(time, pos_x, label="X")
@@ -223,48 +380,58 @@ def plot_2dtrajectory(pos_x,pos_y, pos_z,time):
     ax.legend()
     plt.show()
 
-#sets constants
-f=3
-d=3
-scale=.02
+def main():
+    """Tracks the ball in right.mp4 and left.mp4 and plots its trajectory
+        Inputs: None
+        Outputs: plots
+        Usage: main()
+            Returns: None
+    """
+    import cv2 as cv
 
-# load in right video
-v1 = cv.VideoCapture('right.mp4')
+    #sets constants
+    f=3
+    d=3
+    scale=.02
 
-#loads in left video
-v2 = cv.VideoCapture('left.mp4')
+    # load in right video
+    v1 = cv.VideoCapture('right.mp4')
 
-#gets video properties
-Nframes = int(v1.get(cv.CAP_PROP_FRAME_COUNT))
-width = int(v1.get(cv.CAP_PROP_FRAME_WIDTH))
-height = int(v1.get(cv.CAP_PROP_FRAME_HEIGHT))
+    #loads in left video
+    v2 = cv.VideoCapture('left.mp4')
 
-#get fps
-fps=v1.get(cv.CAP_PROP_FPS)
+    #gets video properties
+    Nframes = int(v1.get(cv.CAP_PROP_FRAME_COUNT))
+    width = int(v1.get(cv.CAP_PROP_FRAME_WIDTH))
+    height = int(v1.get(cv.CAP_PROP_FRAME_HEIGHT))
 
-#calculate video time
-seconds=round(Nframes/fps)
-time=np.arange(0,seconds,seconds/(Nframes-1))
+    #get fps
+    fps=v1.get(cv.CAP_PROP_FPS)
 
-#calculates center of the ball in pixels
-center1_x_pixels, center1_y_pixels, center2_x_pixels, center2_y_pixels=calc_center_pixels(v1,v2,height,width)
+    #calculate video time
+    seconds=round(Nframes/fps)
+    time=np.arange(0,seconds,seconds/(Nframes-1))
 
-#calculates center of the ball in inches of the right camera
-center1_x_inches, center1_y_inches=calc_center_inches(scale,center1_x_pixels, center1_y_pixels,width,height)
+    #calculates center of the ball in pixels
+    center1_x_pixels, center1_y_pixels, center2_x_pixels, center2_y_pixels=calc_center_pixels(v1,v2,height,width)
 
-#calculates center of the ball in inches of the left camera
-center2_x_inches, center2_y_inches=calc_center_inches(scale,center2_x_pixels, center2_y_pixels,width,height)
+    #calculates center of the ball in inches of the right camera
+    center1_x_inches, center1_y_inches=calc_center_inches(scale,center1_x_pixels, center1_y_pixels,width,height)
 
-#plots center of the left and right camera balls
-plot_ball_center(center2_x_inches, center2_y_inches,center1_x_inches, center1_y_inches,)
+    #calculates center of the ball in inches of the left camera
+    center2_x_inches, center2_y_inches=calc_center_inches(scale,center2_x_pixels, center2_y_pixels,width,height)
 
-#calculates x, y, z coordinates over time
-pos_x, pos_y, pos_z=calc_3dtrajectory(f,d,center1_x_inches, center2_x_inches, center2_y_inches)
+    #plots center of the left and right camera balls
+    plot_ball_center(center2_x_inches, center2_y_inches,center1_x_inches, center1_y_inches,)
 
-#plots 2d trajectory over time
-plot_2dtrajectory(pos_x, pos_y,pos_z,time)
+    #calculates x, y, z coordinates over time
+    pos_x, pos_y, pos_z=calc_3dtrajectory(f,d,center1_x_inches, center2_x_inches, center2_y_inches)
 
-#plots 3d trajectory over time
-plot_3dtrajectory(pos_x,pos_y,pos_z)
+    #plots 2d trajectory over time
+    plot_2dtrajectory(pos_x, pos_y,pos_z,time)
 
+    #plots 3d trajectory over time
+    plot_3dtrajectory(pos_x,pos_y,pos_z)
 
+if __name__ == "__main__":
+    main()